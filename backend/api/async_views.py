@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern
+from rest_framework.permissions import SAFE_METHODS
+
+ASYNC_READ_ROUTES = {
+    'tags-list',
+    'tags-detail',
+    'ingredients-list',
+    'ingredients-detail',
+    'recipes-list',
+    'recipes-detail',
+    'recipes-feed',
+    'users-subscriptions',
+}
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_READ_WORKERS,
+                              thread_name_prefix='async-read')
+
+
+def run_read_view(view, request, *args, **kwargs):
+    """
+    Выполняет представление в потоке пула. Сигналы request_started и
+    request_finished приходят в другой поток, поэтому соединения с базой
+    этого потока проверяются здесь: живые переиспользуются между
+    запросами по CONN_MAX_AGE, устаревшие закрываются.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read_view(view):
+    """
+    Асинхронная обертка для ASGI. Django 3.2 выполняет синхронные
+    представления в одном потоке на воркер; безопасные запросы вместо
+    этого уходят в пул из ASYNC_READ_WORKERS потоков и выполняются
+    параллельно, а медленные клиенты обслуживает цикл событий.
+    """
+    run_read = sync_to_async(run_read_view, thread_sensitive=False,
+                             executor=executor)
+    run_write = sync_to_async(view)
+
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method in SAFE_METHODS:
+            return await run_read(view, request, *args, **kwargs)
+        return await run_write(request, *args, **kwargs)
+
+    return wrapper
+
+
+def async_read_urls(patterns, names):
+    return [
+        URLPattern(pattern.pattern, async_read_view(pattern.callback),
+                   pattern.default_args, pattern.name)
+        if isinstance(pattern, URLPattern) and pattern.name in names
+        else pattern
+        for pattern in patterns
+    ]
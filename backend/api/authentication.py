@@ -0,0 +1,87 @@
+import hashlib
+
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .cache import LRUCache
+from foodgram.routers import primary
+from users.models import CustomUser
+
+TOKEN_KEY = 'auth_token:v2:{}'
+TOKEN_TIMEOUT = 5 * 60
+LOCAL_TOKEN_TIMEOUT = 10
+LOCAL_TOKEN_CACHE_SIZE = 1024
+# Поля, нужные сериализаторам и проверкам прав; остальные (пароль,
+# даты) в кэш не попадают и при обращении подгружаются из базы.
+SNAPSHOT_FIELDS = {'id', 'email', 'username', 'first_name', 'last_name',
+                   'is_active', 'is_staff', 'is_superuser'}
+USER_FIELDS = tuple(
+    field.attname for field in CustomUser._meta.concrete_fields
+    if field.attname in SNAPSHOT_FIELDS
+)
+
+token_cache = LRUCache(LOCAL_TOKEN_CACHE_SIZE, LOCAL_TOKEN_TIMEOUT)
+
+
+def token_cache_key(key):
+    """Сам токен в ключи общего кэша не попадает."""
+    return TOKEN_KEY.format(hashlib.sha256(key.encode()).hexdigest())
+
+
+def load_token(key):
+    """
+    Снимок токена и пользователя из базы или None. Читается основная
+    база: только что выданного токена на реплике может еще не быть.
+    """
+    try:
+        with primary():
+            token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    return (token.created,
+            tuple(getattr(token.user, field) for field in USER_FIELDS))
+
+
+def invalidate_tokens(keys):
+    for key in keys:
+        token_cache.delete(key)
+    cache.delete_many([token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication без запроса к базе на каждый запрос: снимки
+    токен -> пользователь хранятся в LRU процесса и в общем кэше.
+    Снимки сбрасываются сигналами при удалении токена (выход),
+    смене пароля и других изменениях пользователя. В LRU других
+    процессов снимок живет не дольше LOCAL_TOKEN_TIMEOUT секунд.
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            cache_key = token_cache_key(key)
+            snapshot = cache.get(cache_key)
+            if snapshot is None:
+                snapshot = load_token(key)
+                if snapshot is None:
+                    raise exceptions.AuthenticationFailed(
+                        _('Invalid token.')
+                    )
+                cache.set(cache_key, snapshot, TOKEN_TIMEOUT)
+            token_cache.set(key, snapshot)
+        created, values = snapshot
+        db = router.db_for_read(CustomUser)
+        user = CustomUser.from_db(db, USER_FIELDS, values)
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        token = Token.from_db(db, ('key', 'user_id', 'created'),
+                              (key, user.pk, created))
+        token.user = user
+        return user, token
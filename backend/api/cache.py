@@ -0,0 +1,257 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import router
+from django.db.models import Sum
+
+from .methods import CHUNK_SIZE
+from foodgram.routers import primary
+from recipes.models import IngredientInRecipe, ShoppingCart, Tag
+from users.models import Subscribe
+
+SHOPPING_LIST_KEY = 'shopping_list:v2:{}:{}'
+SHOPPING_LIST_TIMEOUT = 60 * 60
+SHOPPING_LIST_CACHE_ROWS = 1000
+DATA_VERSION_KEY = 'data_version:{}'
+DATA_VERSION_TIMEOUT = 24 * 60 * 60
+FEED_KEY = 'feed:{}'
+FEED_TIMEOUT = 10 * 60
+REFERENCE_CACHE_SIZE = 512
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш в памяти процесса. С timeout записи
+    устаревают через заданное число секунд.
+    """
+
+    def __init__(self, maxsize, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            expires, value = self.data[key]
+            if expires is not None and expires <= time.monotonic():
+                del self.data[key]
+                return default
+            self.data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires = (time.monotonic() + self.timeout
+                   if self.timeout is not None else None)
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+reference_cache = LRUCache(REFERENCE_CACHE_SIZE)
+
+
+def initial_data_version():
+    """
+    Начальная версия берется от времени, чтобы после потери ключа
+    не вернуться к уже выданным версиям.
+    """
+    return int(time.time() * 1000)
+
+
+def get_data_version(namespace):
+    """
+    Версия данных из общего кэша. Созданный при чтении ключ живет
+    DATA_VERSION_TIMEOUT: бессрочно версию пишет только bump_data_version.
+    """
+    key = DATA_VERSION_KEY.format(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, initial_data_version(), timeout=DATA_VERSION_TIMEOUT)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(namespace):
+    """
+    Сбрасывает все закэшированные данные пространства имен.
+    Возвращает новую версию.
+    """
+    key = DATA_VERSION_KEY.format(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = initial_data_version()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def get_data_versions(namespaces):
+    """Версии нескольких пространств имен за одно обращение к кэшу."""
+    keys = [DATA_VERSION_KEY.format(namespace) for namespace in namespaces]
+    versions = cache.get_many(keys)
+    return [versions[key] if key in versions else get_data_version(namespace)
+            for key, namespace in zip(keys, namespaces)]
+
+
+def get_versioned(namespace, version, key, build):
+    """
+    Значение из кэша в памяти процесса, затем из общего кэша.
+    Ключи включают версию данных, поэтому устаревшие значения
+    просто перестают запрашиваться.
+    """
+    full_key = f'{namespace}:{version}:{key}'
+    value = reference_cache.get(full_key)
+    if value is None:
+        value = cache.get(full_key)
+        if value is None:
+            with primary():
+                value = build()
+            cache.set(full_key, value)
+        reference_cache.set(full_key, value)
+    return value
+
+
+def get_tag_ids():
+    """Словарь slug -> id тегов из версионного кэша справочников."""
+    return get_versioned(
+        'tags', get_data_version('tags'), 'slug_map',
+        lambda: dict(Tag.objects.values_list('slug', 'id')),
+    )
+
+
+def recipe_namespace(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def get_recipe_representation(recipe_id, key, build):
+    """
+    Не зависящая от пользователя часть рецепта. В ключе версии рецепта,
+    тегов и ингредиентов: изменение любой из них сбрасывает копию.
+    Версию рецепта заводим только после успешного build, чтобы запросы
+    к несуществующим рецептам не оставляли ключей в кэше.
+    """
+    namespaces = (recipe_namespace(recipe_id), 'tags', 'ingredients')
+    version_key = DATA_VERSION_KEY.format(namespaces[0])
+    if cache.get(version_key) is None:
+        with primary():
+            value = build()
+        if not cache.add(version_key, initial_data_version(),
+                         timeout=DATA_VERSION_TIMEOUT):
+            # Версию успели поднять: value может быть уже устаревшим.
+            return value
+
+        def build():
+            return value
+    version = '-'.join(map(str, get_data_versions(namespaces)))
+    return get_versioned('recipe', version, f'{recipe_id}:{key}', build)
+
+
+def invalidate_recipes(recipe_ids):
+    for recipe_id in recipe_ids:
+        bump_data_version(recipe_namespace(recipe_id))
+
+
+def shopping_list_namespace(user_id):
+    return f'shopping_list:{user_id}'
+
+
+def shopping_list_rows(user_id):
+    """
+    Строки списка покупок одним GROUP BY запросом, читаются курсором
+    по CHUNK_SIZE. Запрос идет в основную базу явно: строки читаются
+    уже при отдаче ответа, вне блока primary().
+    """
+    return IngredientInRecipe.objects.using(
+        router.db_for_write(IngredientInRecipe)
+    ).filter(
+        recipe__shopping_cart__user_id=user_id
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+    ).annotate(quantity=Sum('amount')).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+def cache_rows(rows, key):
+    """
+    Отдает строки дальше и сохраняет их в кэш, если их не больше
+    SHOPPING_LIST_CACHE_ROWS: память на запрос остается ограниченной.
+    """
+    cached = []
+    for row in rows:
+        if cached is not None:
+            cached.append(row)
+            if len(cached) > SHOPPING_LIST_CACHE_ROWS:
+                cached = None
+        yield row
+    if cached is not None:
+        cache.set(key, cached, SHOPPING_LIST_TIMEOUT)
+
+
+def get_shopping_list(user_id):
+    """
+    Строки списка покупок в формате create_shopping_cart: из кэша или,
+    при промахе, потоком из курсора базы с сохранением в кэш.
+    Ключ включает версию пользователя: список, посчитанный одновременно
+    с изменением корзины, сохраняется под старой версией и не читается.
+    """
+    key = SHOPPING_LIST_KEY.format(
+        user_id, get_data_version(shopping_list_namespace(user_id))
+    )
+    shopping_list = cache.get(key)
+    if shopping_list is not None:
+        return shopping_list
+    return cache_rows(shopping_list_rows(user_id), key)
+
+
+def invalidate_shopping_lists(user_ids):
+    for user_id in user_ids:
+        bump_data_version(shopping_list_namespace(user_id))
+
+
+def recipe_shopping_list_users(recipe_ids):
+    """Пользователи, у которых рецепты лежат в корзине."""
+    return list(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True).distinct())
+
+
+def feed_key(user_id):
+    return FEED_KEY.format(user_id)
+
+
+def get_feed_ids(user_id, build):
+    """id рецептов первой страницы ленты подписок пользователя."""
+    key = feed_key(user_id)
+    ids = cache.get(key)
+    if ids is None:
+        with primary():
+            ids = build()
+        cache.set(key, ids, FEED_TIMEOUT)
+    return ids
+
+
+def invalidate_feeds(user_ids):
+    cache.delete_many([feed_key(user_id) for user_id in user_ids])
+
+
+def author_followers(author_id):
+    return list(Subscribe.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
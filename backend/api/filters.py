@@ -1,33 +1,102 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Tag, Recipe
+from .cache import get_tag_ids
+from .search import search_ingredients, search_recipes
+from recipes.models import Ingredient, Recipe
+
+TAG_MATCH_CHOICES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
+RECIPE_ORDERINGS = {
+    'newest': ('-pub_date', '-id'),
+    'popular': ('-favorites_count', '-id'),
+    'quickest': ('cooking_time', '-id'),
+    'name': ('name', '-id'),
+}
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class IngredientFilter(FilterSet):
-    """Фильтр для поиска ингредиентов по названию"""
-    name = filters.CharFilter(field_name='name', lookup_expr='startswith')
+    """Фильтр для поиска ингредиентов по названию: name - по началу
+    названия, search - сначала по началу, затем по вхождению"""
+    name = filters.CharFilter(method='filter_name')
+    search = filters.CharFilter(method='filter_search')
+    limit = filters.NumberFilter(method='filter_limit', min_value=1)
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def get_limit(self):
+        """Подсказка для поиска, если результаты не пересекаются
+        с другим поисковым фильтром."""
+        data = self.form.cleaned_data
+        if data.get('name') and data.get('search'):
+            return None
+        return int(data['limit']) if data.get('limit') else None
+
+    def filter_name(self, queryset, name, value):
+        return search_ingredients(queryset, value, self.get_limit(),
+                                  substring=False)
+
+    def filter_search(self, queryset, name, value):
+        return search_ingredients(queryset, value, self.get_limit())
+
+    def filter_limit(self, queryset, name, value):
+        return queryset[:int(value)]
+
 
 class RecipeFilter(FilterSet):
-    """Фильтр для поиска Рецептов по тегам, избанному и продуктовой корзине"""
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    """Фильтр для поиска Рецептов по тегам, избанному, продуктовой корзине
+    и полнотекстовый поиск с ранжированием"""
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='filter_tags',
+    )
+    match = filters.ChoiceFilter(
+        choices=TAG_MATCH_CHOICES,
+        method='filter_match',
     )
 
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author',)
 
+    def filter_tags(self, queryset, name, value):
+        """
+        Отбор через EXISTS по таблице связей: без JOIN нет дублей рецептов
+        и не нужен DISTINCT. match=all требует все теги, по умолчанию любой.
+        """
+        tag_ids = get_tag_ids()
+        ids = {tag_ids[slug] for slug in value}
+        links = Recipe.tags.through.objects
+        if self.form.cleaned_data.get('match') == 'all':
+            for tag_id in ids:
+                queryset = queryset.filter(Exists(links.filter(
+                    recipe_id=OuterRef('pk'), tag_id=tag_id
+                )))
+            return queryset
+        return queryset.filter(Exists(links.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=ids
+        )))
+
+    def filter_match(self, queryset, name, value):
+        return queryset
+
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and not user.is_anonymous:
@@ -39,3 +108,10 @@ class RecipeFilter(FilterSet):
         if value and not user.is_anonymous:
             return queryset.filter(shopping_cart__user=user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_ordering(self, queryset, name, value):
+        """Порядки совпадают с составными индексами модели Recipe."""
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
@@ -1,23 +1,125 @@
+import os
 from datetime import datetime
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 
+from users.models import CustomUser
 
-def create_shopping_cart(user, queryset_sort):
+CHUNK_SIZE = 500
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+FILE_FORMATS = ('txt', 'pdf')
+
+
+def lock_user(user):
+    """
+    Блокирует строку пользователя до конца транзакции: изменения его
+    избранного и корзины из параллельных запросов идут по очереди, и
+    проверка существующих связей не расходится со вставкой.
+    """
+    CustomUser.objects.select_for_update().filter(pk=user.pk).exists()
+
+
+def get_recipes_limit(request):
+    """recipes_limit из запроса: положительное целое, иначе None."""
+    try:
+        limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+
+def shopping_cart_lines(user, ingredients):
+    """Построчно формирует список покупок из агрегированных строк."""
     today = datetime.today()
-    shopping_list = (
-        f'Список покупок для: {user.get_full_name()}\n\n'
-        f'Дата: {today:%Y-%m-%d}\n\n'
-    )
-    shopping_list += '\n'.join([
-        f'- {ingredient["ingredient__name"]}'
-        f'({ingredient["ingredient__measurement_unit"]})'
-        f' - {ingredient["quantity"]}'
-        for ingredient in queryset_sort
-    ])
-    shopping_list += f'\n\nFoodgram ({today:%Y})'
-
-    filename = f'{user.username}_shopping_list.txt'
-    response = HttpResponse(shopping_list, content_type='text/plain')
+    yield f'Список покупок для: {user.get_full_name()}'
+    yield ''
+    yield f'Дата: {today:%Y-%m-%d}'
+    yield ''
+    for ingredient in ingredients:
+        yield (
+            f'- {ingredient["ingredient__name"]}'
+            f'({ingredient["ingredient__measurement_unit"]})'
+            f' - {ingredient["quantity"]}'
+        )
+    yield ''
+    yield f'Foodgram ({today:%Y})'
+
+
+def text_chunks(lines, size=CHUNK_SIZE):
+    """Склеивает строки в блоки, чтобы не отдавать ответ по строчке."""
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield '\n'.join(chunk) + '\n'
+            chunk = []
+    if chunk:
+        yield '\n'.join(chunk)
+
+
+@lru_cache(maxsize=None)
+def get_pdf_font():
+    """Регистрирует шрифт с кириллицей, если он есть в системе."""
+    path = settings.SHOPPING_CART_FONT
+    if not os.path.exists(path):
+        return 'Helvetica'
+    pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, path))
+    return PDF_FONT_NAME
+
+
+def render_pdf(lines, file):
+    """Постранично рисует строки в pdf-файл."""
+    font = get_pdf_font()
+    pdf = canvas.Canvas(file, pagesize=A4)
+    width, height = A4
+    pdf.setFont(font, PDF_FONT_SIZE)
+    y = height - PDF_MARGIN
+    for line in lines:
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            pdf.setFont(font, PDF_FONT_SIZE)
+            y = height - PDF_MARGIN
+        pdf.drawString(PDF_MARGIN, y, line)
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+
+
+def create_shopping_cart(user, ingredients, file_format='txt'):
+    """
+    Потоковая выгрузка списка покупок.
+    ingredients - итерируемые агрегированные строки, например
+    queryset.iterator(), чтобы не загружать их в память целиком.
+    Под ASGI Django 3.2 перебирает потоковый ответ в цикле событий, где
+    запросы к базе запрещены, поэтому текст, как и pdf, сначала
+    пишется во временный файл.
+    """
+    lines = shopping_cart_lines(user, ingredients)
+    filename = f'{user.username}_shopping_list.{file_format}'
+    if file_format == 'pdf':
+        file = SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+        render_pdf(lines, file)
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=filename,
+                            content_type='application/pdf')
+    if settings.SERVER_MODE == 'asgi':
+        file = SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE)
+        for chunk in text_chunks(lines):
+            file.write(chunk.encode())
+        file.seek(0)
+        return FileResponse(file, as_attachment=True, filename=filename,
+                            content_type='text/plain')
+    response = StreamingHttpResponse(text_chunks(lines),
+                                     content_type='text/plain')
     response['Content-Disposition'] = f'attachment; filename={filename}'
     return response
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import get_data_version, get_versioned
+
+
+class CachedReferenceMixin:
+    """
+    Отдает list/retrieve справочников из версионного кэша
+    и отвечает 304 на If-None-Match с совпадающим ETag.
+    """
+    cache_namespace = None
+
+    def cached_response(self, request, build):
+        params = sorted(request.query_params.lists())
+        key = hashlib.md5(
+            f'{request.path}|{params}|{request.accepted_renderer.format}'
+            .encode()
+        ).hexdigest()
+        version = get_data_version(self.cache_namespace)
+        etag = f'"{self.cache_namespace}-{version}-{key}"'
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match and (etag in parse_etags(if_none_match)
+                              or if_none_match.strip() == '*'):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(get_versioned(
+                self.cache_namespace, version, key, build
+            ))
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: list(
+            super(CachedReferenceMixin, self).list(
+                request, *args, **kwargs
+            ).data
+        ))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: dict(
+            super(CachedReferenceMixin, self).retrieve(
+                request, *args, **kwargs
+            ).data
+        ))
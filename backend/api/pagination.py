@@ -0,0 +1,152 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """Курсорная пагинация: без COUNT(*) и OFFSET, стоимость любой
+    страницы равна стоимости первой. Порядок берется из запроса,
+    если он задан полями модели, иначе - по первичному ключу.
+
+    Курсор хранит значения всех полей порядка, последнее из которых -
+    id, поэтому позиция уникальна и при равных значениях первого поля
+    (популярность, время приготовления) OFFSET не нужен. Условие
+    на первое поле задает начало диапазона в составном индексе."""
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        ordering = queryset.query.order_by
+        fields = {field.name: field
+                  for field in queryset.model._meta.concrete_fields}
+        if not (ordering and all(
+            isinstance(name, str) and name.lstrip('-') in fields
+            and not fields[name.lstrip('-')].null
+            for name in ordering
+        )):
+            ordering = super().get_ordering(request, queryset, view)
+        ordering = tuple('id' if name.lstrip('-') == 'pk'
+                         else '-id' if name == '-pk' else name
+                         for name in ordering)
+        if ordering[-1].lstrip('-') != 'id':
+            ordering = tuple(name for name in ordering
+                             if name.lstrip('-') != 'id') + ('-id',)
+        self.fields = [fields[name.lstrip('-')] for name in ordering]
+        return ordering
+
+    def _get_position_from_instance(self, instance, ordering):
+        return json.dumps([
+            str(field.value_from_object(instance)) for field in self.fields
+        ])
+
+    def position_filter(self, position, reverse):
+        """
+        Строки после позиции в порядке сортировки:
+        a > x OR (a = x AND b > y) OR ... для полей порядка.
+        """
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(
+                self.fields
+            ):
+                raise ValueError
+            values = [field.to_python(value)
+                      for field, value in zip(self.fields, values)]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        lookups = []
+        for name in self.ordering:
+            after = 'lt' if name.startswith('-') != reverse else 'gt'
+            lookups.append((name.lstrip('-'), after))
+        condition = Q()
+        equal = {}
+        for (name, after), value in zip(lookups, values):
+            condition |= Q(**equal, **{f'{name}__{after}': value})
+            equal[name] = value
+        first, after = lookups[0]
+        return Q(**{f'{first}__{after}e': values[0]}) & condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """CursorPagination.paginate_queryset с фильтром по позиции
+        из всех полей порядка вместо первого."""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            offset, reverse, current_position = 0, False, None
+        else:
+            offset, reverse, current_position = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*[
+                name[1:] if name.startswith('-') else f'-{name}'
+                for name in self.ordering
+            ])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if current_position is not None:
+            queryset = queryset.filter(
+                self.position_filter(current_position, reverse)
+            )
+
+        results = list(queryset[offset:offset + self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(
+                results[-1], self.ordering
+            )
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = current_position is not None or offset > 0
+            self.has_previous = following_position is not None
+            self.next_position = current_position
+            self.previous_position = following_position
+        else:
+            self.has_next = following_position is not None
+            self.has_previous = current_position is not None or offset > 0
+            self.next_position = following_position
+            self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+
+class PageNumberOrKeysetPagination(PageNumberPagination):
+    """Постраничная пагинация, которая переключается на курсорную
+    по параметру ?pagination=cursor или при наличии курсора в запросе."""
+    mode_query_param = 'pagination'
+    keyset_mode = 'cursor'
+
+    def __init__(self):
+        self.keyset = None
+
+    def use_keyset(self, request):
+        params = request.query_params
+        return (params.get(self.mode_query_param) == self.keyset_mode
+                or KeysetPagination.cursor_query_param in params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_keyset(request):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_html_context(self):
+        if self.keyset is not None:
+            return self.keyset.get_html_context()
+        return super().get_html_context()
@@ -0,0 +1,309 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import chain, islice
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector)
+from django.core.cache import cache
+from django.db import connections, router, transaction
+from django.db.models import (Case, F, IntegerField, OuterRef, Q, Subquery,
+                              Value, When)
+
+from .cache import bump_data_version, get_data_version
+from foodgram.routers import primary
+from recipes.models import Ingredient, IngredientInRecipe, Recipe
+
+MAX_INDEX_RESULTS = 500
+MAX_RECIPE_RESULTS = 1000
+SEARCH_CHANGES_KEY = 'search_changes:{}'
+SEARCH_CHANGES_TIMEOUT = 60 * 60
+MAX_INCREMENTAL_RECIPES = 1000
+MAX_INCREMENTAL_VERSIONS = 100
+SEARCH_CONFIG = 'russian'
+RECIPE_WEIGHTS = (('name', 1.0), ('ingredients', 0.4), ('text', 0.1))
+TOKEN_RE = re.compile(r'\w+')
+
+
+class IngredientIndex:
+    """
+    Индекс названий ингредиентов в памяти: отсортированный список
+    для поиска по префиксу и триграммы для поиска по подстроке.
+    """
+
+    def __init__(self, rows):
+        self.items = sorted((name.lower(), pk) for pk, name in rows)
+        self.names = [name for name, _ in self.items]
+        self.trigrams = defaultdict(list)
+        for position, name in enumerate(self.names):
+            for trigram in {name[i:i + 3] for i in range(len(name) - 2)}:
+                self.trigrams[trigram].append(position)
+
+    def prefix(self, value):
+        for position in range(bisect_left(self.names, value),
+                              len(self.names)):
+            if not self.names[position].startswith(value):
+                break
+            yield position
+
+    def substring(self, value):
+        if len(value) < 3:
+            positions = range(len(self.names))
+        else:
+            postings = sorted(
+                (self.trigrams.get(value[i:i + 3], ())
+                 for i in range(len(value) - 2)),
+                key=len
+            )
+            positions = sorted(
+                set(postings[0]).intersection(*postings[1:])
+            )
+        for position in positions:
+            name = self.names[position]
+            if value in name and not name.startswith(value):
+                yield position
+
+    def search(self, value, limit=None, substring=True):
+        """id ингредиентов: сначала по префиксу, затем по подстроке."""
+        value = value.lower()
+        positions = self.prefix(value)
+        if substring:
+            positions = chain(positions, self.substring(value))
+        return [self.items[position][1]
+                for position in islice(positions, limit)]
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class RecipeIndex:
+    """
+    Инвертированный индекс рецептов в памяти: слово -> {id: вес}.
+    Веса полей повторяют веса A/B/C поискового вектора Postgres.
+    Отдельные рецепты обновляются на месте методом update.
+    """
+
+    def __init__(self, recipes):
+        self.lock = threading.Lock()
+        self.postings = defaultdict(dict)
+        self.tokens = {}
+        for pk, fields in recipes:
+            self.add(pk, fields)
+        self.terms = sorted(self.postings)
+
+    def add(self, pk, fields):
+        tokens = set()
+        for field, weight in RECIPE_WEIGHTS:
+            for token in tokenize(fields[field]):
+                postings = self.postings[token]
+                postings[pk] = postings.get(pk, 0) + weight
+                tokens.add(token)
+        self.tokens[pk] = tokens
+
+    def update(self, recipe_ids, recipes):
+        """
+        Переиндексирует рецепты recipe_ids; тех, что нет в recipes
+        (id -> поля), удаляет из индекса.
+        """
+        with self.lock:
+            for pk in recipe_ids:
+                for token in self.tokens.pop(pk, ()):
+                    postings = self.postings[token]
+                    postings.pop(pk, None)
+                    if not postings:
+                        del self.postings[token]
+                        del self.terms[bisect_left(self.terms, token)]
+                if pk in recipes:
+                    self.add(pk, recipes[pk])
+                    for token in self.tokens[pk]:
+                        position = bisect_left(self.terms, token)
+                        if (position == len(self.terms)
+                                or self.terms[position] != token):
+                            self.terms.insert(position, token)
+
+    def matches(self, token):
+        """Слова, начинающиеся с токена: грубая замена стемминга."""
+        scores = defaultdict(float)
+        for position in range(bisect_left(self.terms, token),
+                              len(self.terms)):
+            term = self.terms[position]
+            if not term.startswith(token):
+                break
+            for pk, weight in self.postings[term].items():
+                scores[pk] += weight
+        return scores
+
+    def search(self, value, limit=None):
+        """id рецептов, содержащих все слова запроса, по убыванию веса."""
+        scores = None
+        with self.lock:
+            for token in tokenize(value):
+                matches = self.matches(token)
+                if scores is None:
+                    scores = matches
+                else:
+                    scores = {pk: score + matches[pk]
+                              for pk, score in scores.items()
+                              if pk in matches}
+        if not scores:
+            return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+        return [pk for pk, _ in ranked[:limit]]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(namespace, build):
+    """Индекс текущей версии данных, строится раз на процесс."""
+    version = get_data_version(namespace)
+    with _indexes_lock, primary():
+        if namespace not in _indexes or _indexes[namespace][0] != version:
+            _indexes[namespace] = (version, build())
+        return _indexes[namespace][1]
+
+
+def get_ingredient_index():
+    return get_index('ingredients', lambda: IngredientIndex(
+        Ingredient.objects.values_list('id', 'name').iterator()
+    ))
+
+
+def recipe_fields(recipe_ids=None):
+    """Индексируемые поля рецептов: id -> название, описание, ингредиенты."""
+    recipes = Recipe.objects.all()
+    links = IngredientInRecipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+        links = links.filter(recipe_id__in=recipe_ids)
+    fields = {
+        pk: {'name': name, 'text': text, 'ingredients': ''}
+        for pk, name, text in recipes.values_list(
+            'id', 'name', 'text'
+        ).order_by().iterator()
+    }
+    for recipe_id, name in links.values_list(
+        'recipe_id', 'ingredient__name'
+    ).order_by().iterator():
+        if recipe_id in fields:
+            fields[recipe_id]['ingredients'] += f' {name}'
+    return fields
+
+
+def get_recipe_index():
+    """
+    Индекс текущей версии. Если процесс отстал на несколько версий и
+    в кэше есть списки измененных в них рецептов, перечитываются только
+    эти рецепты, иначе индекс строится заново.
+    """
+    version = get_data_version('recipes')
+    with _indexes_lock, primary():
+        indexed, index = _indexes.get('recipes', (None, None))
+        if indexed == version:
+            return index
+        if (indexed is not None
+                and 0 < version - indexed <= MAX_INCREMENTAL_VERSIONS):
+            keys = [SEARCH_CHANGES_KEY.format(number)
+                    for number in range(indexed + 1, version + 1)]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                recipe_ids = set(chain.from_iterable(changes.values()))
+                index.update(recipe_ids, recipe_fields(recipe_ids))
+                _indexes['recipes'] = (version, index)
+                return index
+        index = RecipeIndex(recipe_fields().items())
+        _indexes['recipes'] = (version, index)
+        return index
+
+
+def publish_search_changes(recipe_ids):
+    """
+    Новая версия индекса рецептов и список измененных в ней рецептов,
+    по которому процессы обновляют свои индексы на месте.
+    """
+    version = bump_data_version('recipes')
+    if recipe_ids is not None and len(recipe_ids) <= MAX_INCREMENTAL_RECIPES:
+        cache.set(SEARCH_CHANGES_KEY.format(version), list(recipe_ids),
+                  SEARCH_CHANGES_TIMEOUT)
+
+
+def update_search_vectors(recipe_ids=None):
+    """
+    Пересчитывает поисковый вектор рецептов (в Postgres) и после
+    коммита обновляет индексы в памяти. recipe_ids=None - все рецепты.
+    """
+    if connections[router.db_for_write(Recipe)].vendor == 'postgresql':
+        ingredient_names = Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe=OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        )
+        recipes = Recipe.objects.all()
+        if recipe_ids is not None:
+            recipes = recipes.filter(pk__in=recipe_ids)
+        recipes.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector(ingredient_names, weight='B',
+                           config=SEARCH_CONFIG)
+            + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+        ))
+    transaction.on_commit(lambda: publish_search_changes(recipe_ids))
+
+
+def search_recipes(queryset, value):
+    """
+    Полнотекстовый поиск рецептов по названию, ингредиентам и описанию
+    с ранжированием. В Postgres - по GIN-индексу поискового вектора.
+    """
+    if connections[queryset.db].vendor == 'postgresql':
+        query = SearchQuery(value, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-id')
+    ids = get_recipe_index().search(value, MAX_RECIPE_RESULTS)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(pk__in=ids).order_by(Case(
+        *[When(pk=pk, then=Value(position))
+          for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    ))
+
+
+def search_ingredients(queryset, value, limit=None, substring=True):
+    """
+    Поиск ингредиентов: совпадения по префиксу идут раньше совпадений
+    по подстроке. В Postgres запрос обслуживают индексы по UPPER(name),
+    в остальных базах - индекс в памяти, если совпадений немного.
+    limit только подсказывает, сколько результатов нужно: срез
+    выполняет вызывающий код.
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        ids = get_ingredient_index().search(
+            value, limit or MAX_INDEX_RESULTS + 1, substring
+        )
+        if not ids:
+            return queryset.none()
+        if len(ids) <= MAX_INDEX_RESULTS:
+            return queryset.filter(pk__in=ids).order_by(Case(
+                *[When(pk=pk, then=Value(position))
+                  for position, pk in enumerate(ids)],
+                output_field=IntegerField(),
+            ))
+    lookup = (Q(name__icontains=value) if substring
+              else Q(name__istartswith=value))
+    queryset = queryset.filter(lookup).annotate(
+        search_rank=Case(
+            When(name__istartswith=value, then=Value(0)),
+            default=Value(1),
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank', 'name')
+    return queryset
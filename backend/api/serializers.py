@@ -1,8 +1,18 @@
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers, status
 from rest_framework.validators import UniqueTogetherValidator
 
+from .cache import (
+    get_tag_ids,
+    invalidate_shopping_lists,
+    recipe_shopping_list_users,
+)
+from .methods import get_recipes_limit
+from .search import update_search_vectors
+from recipes.images import variant_url
+
 from recipes.models import (
     Tag,
     Ingredient,
@@ -15,6 +25,25 @@ from users.models import CustomUser
 
 MIN_AMOUNT = 1
 MAX_AMOUNT = 32000
+MAX_BATCH_SIZE = 100
+
+
+class RecipeImageField(serializers.ImageField):
+    """Только URL уменьшенной копии изображения рецепта."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        url = variant_url(value, self.variant)
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -49,10 +78,12 @@ class UsersSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
+        request = self.context.get('request')
+        if request.user.is_anonymous:
             return False
-        return user.follower.filter(author=obj).exists()
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        return obj.following.filter(user=request.user).exists()
 
 
 class UsersCreateSerializer(UserCreateSerializer):
@@ -77,16 +108,19 @@ class SubscribeSerializer(UsersSerializer):
         read_only_fields = ['email', 'username', 'first_name', 'last_name']
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.GET.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if limit:
-            recipes = recipes[:int(limit)]
-        serializer = RecipeSerializer(recipes, many=True)
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            limit = get_recipes_limit(self.context.get('request'))
+            recipes = obj.recipes.all()
+            if limit is not None:
+                recipes = recipes[:limit]
+        serializer = RecipeSerializer(recipes, many=True,
+                                      context=self.context)
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def validate(self, data):
         author = self.instance
@@ -119,7 +153,7 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
 
 class AddIngredientSerializer(serializers.ModelSerializer):
     """Сериализатор для создания ингредиентов в рецептах."""
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField(min_value=1)
     amount = serializers.IntegerField(max_value=MAX_AMOUNT,
                                       min_value=MIN_AMOUNT)
 
@@ -132,9 +166,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для создания Рецепта."""
     author = UsersSerializer(read_only=True)
     ingredients = AddIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True
-    )
+    tags = serializers.ListField(child=serializers.IntegerField(min_value=1))
     image = Base64ImageField()
     cooking_time = serializers.IntegerField(max_value=MAX_AMOUNT,
                                             min_value=MIN_AMOUNT)
@@ -145,12 +177,24 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                   'image', 'name', 'text', 'cooking_time')
 
     def validate_ingredients(self, data):
-        ingredients_ids = [ingredient['id'].id for ingredient in data]
+        ingredients_ids = [ingredient['id'] for ingredient in data]
         if len(ingredients_ids) != len(set(ingredients_ids)):
             raise serializers.ValidationError(
                 detail='Ингредиент должен быть уникальным!',
                 code=status.HTTP_400_BAD_REQUEST
             )
+        missing = set(ingredients_ids).difference(
+            Ingredient.objects.filter(
+                id__in=ingredients_ids
+            ).values_list('id', flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                detail='Ингредиенты не найдены: {}'.format(
+                    ', '.join(map(str, sorted(missing)))
+                ),
+                code=status.HTTP_400_BAD_REQUEST
+            )
         return data
 
     def validate_tags(self, data):
@@ -159,16 +203,24 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
                 detail='Выберите хотя бы один тег!',
                 code=status.HTTP_400_BAD_REQUEST
             )
-        if data != set(data):
+        if len(data) != len(set(data)):
             raise serializers.ValidationError(
                 detail='Тег должен быть уникальным!',
                 code=status.HTTP_400_BAD_REQUEST
             )
+        missing = set(data).difference(get_tag_ids().values())
+        if missing:
+            raise serializers.ValidationError(
+                detail='Теги не найдены: {}'.format(
+                    ', '.join(map(str, sorted(missing)))
+                ),
+                code=status.HTTP_400_BAD_REQUEST
+            )
         return data
 
     def add_ingredients(self, ingredients, recipe):
         IngredientInRecipe.objects.bulk_create([IngredientInRecipe(
-            ingredient=ingredient['id'],
+            ingredient_id=ingredient['id'],
             recipe=recipe,
             amount=ingredient['amount']
         ) for ingredient in ingredients])
@@ -180,35 +232,77 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(author=request.user, **validated_data)
         recipe.tags.set(tags)
         self.add_ingredients(ingredients, recipe)
+        update_search_vectors([recipe.id])
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к переданным, меняя только
+        отличающиеся строки. Возвращает True, если состав изменился.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients}
+        existing = {link.ingredient_id: link
+                    for link in recipe.IngredientInRecipe.all()}
+        removed = [link.id for ingredient_id, link in existing.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, link in existing.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and link.amount != amount:
+                link.amount = amount
+                changed.append(link)
+        added = [IngredientInRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                                    amount=amount)
+                 for ingredient_id, amount in amounts.items()
+                 if ingredient_id not in existing]
+        if removed:
+            IngredientInRecipe.objects.filter(id__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientInRecipe.objects.bulk_create(added)
+        return bool(removed or changed or added)
+
+    def update_tags(self, recipe, tags):
+        current = set(recipe.tags.values_list('id', flat=True))
+        new = set(tags)
+        if current - new:
+            recipe.tags.remove(*(current - new))
+        if new - current:
+            recipe.tags.add(*(new - current))
+
+    @transaction.atomic
     def update(self, recipe, validated_data):
         tags = validated_data.get('tags')
         ingredients = validated_data.get('ingredients')
+        recipe = Recipe.objects.select_for_update().get(pk=recipe.pk)
         recipe.image = validated_data.get('image', recipe.image)
         recipe.name = validated_data.get('name', recipe.name)
         recipe.text = validated_data.get('text', recipe.text)
         recipe.cooking_time = validated_data.get('cooking_time',
                                                  recipe.cooking_time)
-        if ingredients:
-            recipe.ingredients.clear()
-            self.add_ingredients(ingredients, recipe)
-        if tags:
-            recipe.tags.clear()
-            recipe.tags.set(tags)
         recipe.save()
+        if ingredients and self.update_ingredients(recipe, ingredients):
+            users = recipe_shopping_list_users([recipe.id])
+            transaction.on_commit(lambda: invalidate_shopping_lists(users))
+        if tags:
+            self.update_tags(recipe, tags)
+        update_search_vectors([recipe.id])
         return recipe
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         return RecipeListSerializer(instance, context=context).data
 
 
 class RecipeSerializer(serializers.ModelSerializer):
     """Простой сериализатор для отображения Рецептов."""
     name = serializers.ReadOnlyField()
-    image = Base64ImageField(read_only=True)
+    image = RecipeImageField('thumb')
     cooking_time = serializers.ReadOnlyField()
 
     class Meta:
@@ -225,7 +319,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
-    image = Base64ImageField()
+    image = RecipeImageField('card')
 
     class Meta:
         model = Recipe
@@ -237,15 +331,37 @@ class RecipeListSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
-        user = request.user
-        return user.favorites.filter(recipe=obj).exists()
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
+        return obj.favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
         request = self.context.get('request')
         if request.user.is_anonymous:
             return False
-        user = request.user
-        return user.shopping_cart.filter(recipe=obj).exists()
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.shopping_cart.filter(user=request.user).exists()
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'is_author_subscribed'):
+            instance.author.is_subscribed = instance.is_author_subscribed
+        return super().to_representation(instance)
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Сериализатор списка id рецептов для пакетных операций."""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BATCH_SIZE,
+        error_messages={
+            'max_length': 'Не больше {max_length} рецептов за запрос!',
+        },
+    )
+
+    def validate_recipes(self, data):
+        return list(dict.fromkeys(data))
 
 
 class FavoriteRecipeSerializer(serializers.ModelSerializer):
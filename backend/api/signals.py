@@ -0,0 +1,205 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import invalidate_tokens
+from .cache import (
+    author_followers,
+    bump_data_version,
+    invalidate_feeds,
+    invalidate_recipes,
+    invalidate_shopping_lists,
+    recipe_shopping_list_users,
+)
+from .search import publish_search_changes, update_search_vectors
+from recipes.images import schedule_variants, variants_exist
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users.models import CustomUser, Subscribe
+
+
+def counter_changed(model, field, counter):
+    """
+    Обработчики сигналов, сдвигающие счетчик связанной записи одним
+    UPDATE с F(): в той же транзакции и без гонок между запросами.
+    """
+
+    def change(instance, delta):
+        model.objects.filter(pk=getattr(instance, field)).update(
+            **{counter: Greatest(F(counter) + delta, 0)}
+        )
+
+    def saved(sender, instance, created, **kwargs):
+        if created:
+            change(instance, 1)
+
+    def deleted(sender, instance, **kwargs):
+        change(instance, -1)
+
+    return saved, deleted
+
+
+for sender, model, field, counter in (
+    (Favorite, Recipe, 'recipe_id', 'favorites_count'),
+    (ShoppingCart, Recipe, 'recipe_id', 'in_carts_count'),
+    (Subscribe, CustomUser, 'author_id', 'followers_count'),
+    (Recipe, CustomUser, 'author_id', 'recipes_count'),
+):
+    saved, deleted = counter_changed(model, field, counter)
+    post_save.connect(saved, sender=sender, weak=False)
+    post_delete.connect(deleted, sender=sender, weak=False)
+
+
+@receiver([post_save, post_delete], sender=ShoppingCart)
+def shopping_cart_changed(sender, instance, **kwargs):
+    """Сбрасывает сохраненный список покупок пользователя."""
+    transaction.on_commit(
+        lambda: invalidate_shopping_lists([instance.user_id])
+    )
+
+
+def mark_variants_ready(names):
+    """Отмечает копии готовыми у всех рецептов с этими изображениями."""
+    recipe_ids = list(Recipe.objects.filter(
+        image__in=names, image_variants=False
+    ).values_list('id', flat=True))
+    Recipe.objects.filter(id__in=recipe_ids).update(image_variants=True)
+    invalidate_recipes(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    """
+    Сверяет флаг image_variants с хранилищем и готовит уменьшенные
+    копии нового изображения рецепта. Пока их нет, отдается оригинал.
+    """
+    if not instance.image:
+        return
+    name = instance.image.name
+    ready = variants_exist(name)
+    if ready != instance.image_variants:
+        instance.image_variants = ready
+        Recipe.objects.filter(pk=instance.pk).update(image_variants=ready)
+    if not ready:
+        schedule_variants(name, lambda: mark_variants_ready([name]))
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_published(sender, instance, created=True, **kwargs):
+    """Новый или удаленный рецепт меняет ленты подписчиков автора."""
+    if created:
+        user_ids = author_followers(instance.author_id)
+        if user_ids:
+            transaction.on_commit(lambda: invalidate_feeds(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Subscribe)
+def subscription_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_feeds([instance.user_id]))
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """
+    Ингредиенты удаляемого рецепта уже не прочитать после удаления,
+    поэтому списки покупок с ним сбрасываются целиком.
+    """
+    user_ids = recipe_shopping_list_users([instance.id])
+    if user_ids:
+        transaction.on_commit(lambda: invalidate_shopping_lists(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(lambda: bump_data_version('tags'))
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    """
+    Название ингредиента входит в поисковый вектор его рецептов,
+    название и единица измерения - в списки покупок.
+    """
+    recipe_ids = list(IngredientInRecipe.objects.filter(
+        ingredient_id=instance.id
+    ).values_list('recipe_id', flat=True))
+    transaction.on_commit(lambda: bump_data_version('ingredients'))
+    if recipe_ids:
+        user_ids = recipe_shopping_list_users(recipe_ids)
+        transaction.on_commit(lambda: update_search_vectors(recipe_ids))
+        transaction.on_commit(lambda: invalidate_shopping_lists(user_ids))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    """Сбрасывает закэшированное представление рецепта после коммита."""
+    recipe_id = instance.id
+    transaction.on_commit(lambda: invalidate_recipes([recipe_id]))
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    user_ids = recipe_shopping_list_users([instance.recipe_id])
+    transaction.on_commit(lambda: invalidate_recipes([instance.recipe_id]))
+    if user_ids:
+        transaction.on_commit(lambda: invalidate_shopping_lists(user_ids))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, reverse, action, **kwargs):
+    """Изменения со стороны тега сбрасывают все рецепты через его версию."""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        transaction.on_commit(lambda: bump_data_version('tags'))
+    else:
+        transaction.on_commit(lambda: invalidate_recipes([instance.id]))
+
+
+@receiver(post_save, sender=CustomUser)
+def author_changed(sender, instance, created, update_fields, **kwargs):
+    """Данные автора входят в представление каждого его рецепта."""
+    if created or update_fields == frozenset(['last_login']):
+        return
+    recipe_ids = list(instance.recipes.values_list('id', flat=True))
+    if recipe_ids:
+        transaction.on_commit(lambda: invalidate_recipes(recipe_ids))
+
+
+@receiver(post_save, sender=CustomUser)
+def user_changed(sender, instance, created, update_fields, **kwargs):
+    """
+    Смена пароля, деактивация и правка профиля сбрасывают снимки
+    пользователя в кэше аутентификации.
+    """
+    if created or update_fields == frozenset(['last_login']):
+        return
+    keys = list(Token.objects.filter(
+        user_id=instance.id
+    ).values_list('key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: invalidate_tokens(keys))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Выход (удаление токена) и удаление пользователя."""
+    transaction.on_commit(lambda: invalidate_tokens([instance.key]))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    """Удаленный рецепт убирается из поисковых индексов в памяти."""
+    recipe_id = instance.id
+    transaction.on_commit(lambda: publish_search_changes([recipe_id]))
@@ -0,0 +1,461 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from .authentication import token_cache, token_cache_key
+from . import search
+from .cache import reference_cache
+from .views import RecipesViewSet
+
+from foodgram.instrumentation import QueryInstrumentationMiddleware
+from foodgram.routers import ReplicaMiddleware, read_alias
+from recipes.images import VARIANT_EXTENSION
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users.models import CustomUser, Subscribe
+
+
+class QueryCountTests(TestCase):
+    """
+    Число запросов к базе на основных эндпоинтах не зависит от числа
+    рецептов, ингредиентов и тегов на странице.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.token = Token.objects.create(user=cls.user)
+        tags = [
+            Tag.objects.create(name=f'Тег {number}',
+                               color=f'#00000{number}',
+                               slug=f'tag_{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(3):
+            author = CustomUser.objects.create_user(
+                username=f'author_{number}',
+                email=f'author_{number}@example.com',
+                password='pass',
+            )
+            Subscribe.objects.create(user=cls.user, author=author)
+            for position in range(4):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт {number}-{position}',
+                    text='Описание', cooking_time=10,
+                    image='recipes/test.png',
+                )
+                recipe.tags.set(tags[:position % 3 + 1])
+                IngredientInRecipe.objects.bulk_create([
+                    IngredientInRecipe(recipe=recipe, ingredient=ingredient,
+                                       amount=10)
+                    for ingredient in ingredients[:position + 2]
+                ])
+                if position % 2:
+                    Favorite.objects.create(user=cls.user, recipe=recipe)
+                    ShoppingCart.objects.create(user=cls.user,
+                                                recipe=recipe)
+        cls.recipe = Recipe.objects.first()
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        reference_cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token}')
+
+    def assert_queries(self, count, url):
+        with self.assertNumQueries(count):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_recipe_list(self):
+        # токен, count, страница, теги, ингредиенты
+        response = self.assert_queries(5, '/api/recipes/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assert_queries(4, '/api/recipes/')
+
+    def test_recipe_list_anonymous(self):
+        self.client.credentials()
+        self.assert_queries(4, '/api/recipes/')
+
+    def test_recipe_detail(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        # токен, рецепт, теги, ингредиенты, флаги пользователя
+        response = self.assert_queries(5, url)
+        self.assertEqual(len(response.data['ingredients']), 2)
+        self.assert_queries(1, url)
+
+    def test_missing_recipe_detail(self):
+        response = self.client.get('/api/recipes/999999/')
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(cache.get('data_version:recipe:999999'))
+
+    def test_recipe_detail_flags(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        self.assertFalse(self.client.get(url).data['is_favorited'])
+        self.client.post(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.assertTrue(self.client.get(url).data['is_favorited'])
+        self.client.delete(f'/api/users/{self.recipe.author_id}/subscribe/')
+        self.assertFalse(
+            self.client.get(url).data['author']['is_subscribed']
+        )
+
+    def test_subscriptions(self):
+        # токен, count, авторы, превью рецептов
+        response = self.assert_queries(
+            4, '/api/users/subscriptions/?recipes_limit=2'
+        )
+        self.assertEqual(len(response.data['results']), 3)
+        self.assert_queries(3, '/api/users/subscriptions/')
+
+    def test_subscriptions_invalid_limit(self):
+        for limit in ('-1', '0', 'abc'):
+            response = self.client.get(
+                f'/api/users/subscriptions/?recipes_limit={limit}'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results'][0]['recipes']), 4)
+        author = CustomUser.objects.create_user(
+            username='new_author', email='new_author@example.com',
+            password='pass',
+        )
+        response = self.client.post(
+            f'/api/users/{author.id}/subscribe/?recipes_limit=-1'
+        )
+        self.assertEqual(response.status_code, 201)
+
+    def download(self):
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_shopping_list_download(self):
+        # токен и версия в кэше, список - потоком из курсора базы
+        with self.assertNumQueries(2):
+            content = self.download()
+        self.assertIn('- Ингредиент 0(г) - 60', content)
+        self.assertIn('- Ингредиент 4(г) - 30', content)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.download(), content)
+
+    def test_long_shopping_list_not_cached(self):
+        with mock.patch('api.cache.SHOPPING_LIST_CACHE_ROWS', 2):
+            content = self.download()
+            with self.assertNumQueries(1):
+                self.assertEqual(self.download(), content)
+
+    def test_feed(self):
+        # токен, id ленты, страница, теги, ингредиенты
+        response = self.assert_queries(5, '/api/recipes/feed/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assert_queries(3, '/api/recipes/feed/')
+
+    def test_images_without_storage_checks(self):
+        Recipe.objects.filter(id=self.recipe.id).update(image_variants=True)
+        with mock.patch.object(default_storage, 'exists') as exists:
+            response = self.client.get('/api/recipes/')
+        exists.assert_not_called()
+        images = {recipe['id']: recipe['image']
+                  for recipe in response.data['results']}
+        self.assertTrue(images[self.recipe.id].endswith('test_card.'
+                                                        + VARIANT_EXTENSION))
+        self.assertTrue(all(image.endswith('/test.png')
+                            for recipe_id, image in images.items()
+                            if recipe_id != self.recipe.id))
+
+
+class TokenCacheTests(TestCase):
+    """Снимок пользователя в общем кэше не содержит хеша пароля."""
+
+    def test_snapshot_without_password(self):
+        user = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='old-pass-123!',
+        )
+        token = Token.objects.create(user=user)
+        cache.clear()
+        token_cache.clear()
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        response = client.get('/api/users/me/')
+        self.assertEqual(response.data['username'], 'reader')
+        snapshot = cache.get(token_cache_key(token.key))
+        self.assertNotIn(user.password, snapshot[1])
+        response = client.post('/api/users/set_password/', {
+            'current_password': 'old-pass-123!',
+            'new_password': 'new-pass-456!',
+        })
+        self.assertEqual(response.status_code, 204)
+        user.refresh_from_db()
+        self.assertTrue(user.check_password('new-pass-456!'))
+
+
+class BatchUpdateTests(TestCase):
+    """Пакетное добавление и удаление рецептов в избранное и корзину."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com', password='pass'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10,
+            )
+            for number in range(3)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def batch(self, method, url, recipes):
+        response = getattr(self.client, method)(
+            url, {'recipes': [recipe.id for recipe in recipes]},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return [result['status'] for result in response.data['results']]
+
+    def test_delete_updates_counters(self):
+        url = '/api/recipes/shopping_cart/'
+        self.batch('post', url, self.recipes)
+        # точка сохранения, блокировка, рецепты, связи, удаление,
+        # счетчики, освобождение точки сохранения
+        with self.assertNumQueries(7):
+            statuses = self.batch('delete', url, self.recipes[:2])
+        self.assertEqual(statuses, ['deleted', 'deleted'])
+        self.assertEqual(
+            [recipe.in_carts_count
+             for recipe in Recipe.objects.order_by('id')],
+            [0, 0, 1],
+        )
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+
+    def test_recipe_deleted_before_insert(self):
+        gone = self.recipes[0]
+        insert_links = RecipesViewSet.insert_links
+
+        def delete_and_insert(*args):
+            Recipe.objects.filter(pk=gone.pk).delete()
+            insert_links(*args)
+
+        with mock.patch.object(RecipesViewSet, 'insert_links',
+                               side_effect=delete_and_insert):
+            statuses = self.batch('post', '/api/recipes/favorite/',
+                                  self.recipes)
+        self.assertEqual(statuses, ['not_found', 'created', 'created'])
+        self.assertEqual(
+            [recipe.favorites_count
+             for recipe in Recipe.objects.order_by('id')],
+            [1, 1],
+        )
+
+
+class RecipeSearchIndexTests(TestCase):
+    """Изменения рецептов обновляют индекс в памяти без перестроения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Борщ', text='Свекла', cooking_time=60,
+        )
+
+    def setUp(self):
+        cache.clear()
+        search._indexes.clear()
+
+    def search(self, value):
+        response = self.client.get(f'/api/recipes/?search={value}')
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_incremental_update(self):
+        self.assertEqual(self.search('борщ'), [self.recipe.id])
+        with mock.patch.object(search, 'RecipeIndex',
+                               wraps=search.RecipeIndex) as index_class:
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    author=self.author, name='Зеленый борщ',
+                    text='Щавель', cooking_time=40,
+                )
+                search.update_search_vectors([recipe.id])
+                self.recipe.name = 'Солянка'
+                self.recipe.save()
+                search.update_search_vectors([self.recipe.id])
+            self.assertEqual(self.search('борщ'), [recipe.id])
+            self.assertEqual(self.search('солянка'), [self.recipe.id])
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe.delete()
+            self.assertEqual(self.search('борщ'), [])
+            self.assertEqual(self.search('щавель'), [])
+        index_class.assert_not_called()
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Курсор по порядкам с повторяющимися значениями не использует
+    OFFSET и читает составной индекс с нужной позиции.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        author = CustomUser.objects.create_user(
+            username='author', email='author@example.com', password='pass'
+        )
+        for number in range(15):
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Описание',
+                cooking_time=10 + number % 2, favorites_count=number % 3,
+                image='recipes/test.png',
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def pages(self, ordering):
+        url = f'/api/recipes/?pagination=cursor&ordering={ordering}'
+        ids, queries = [], []
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            queries += [query['sql'] for query in context.captured_queries]
+            url = response.data['next']
+        return ids, queries
+
+    def test_ties_without_offset(self):
+        for ordering, key in (
+            ('popular', lambda recipe: (-recipe.favorites_count, -recipe.id)),
+            ('quickest', lambda recipe: (recipe.cooking_time, -recipe.id)),
+        ):
+            ids, queries = self.pages(ordering)
+            expected = [recipe.id
+                        for recipe in sorted(Recipe.objects.all(), key=key)]
+            self.assertEqual(ids, expected)
+            self.assertFalse(any('OFFSET' in sql for sql in queries))
+
+    def query_plan(self, url):
+        """План запроса страницы, выполненного по url."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        sql = next(query['sql'] for query in context.captured_queries
+                   if 'ORDER BY' in query['sql'])
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return [row[-1] for row in cursor.fetchall()]
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_explain_uses_index(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest('EXPLAIN проверяется для SQLite и PostgreSQL')
+        author_id = Recipe.objects.values_list('author_id', flat=True)[0]
+        for query, index in (
+            ('ordering=newest', 'recipe_newest_idx'),
+            ('ordering=popular', 'recipe_popular_idx'),
+            ('ordering=quickest', 'recipe_quickest_idx'),
+            ('ordering=name', 'recipe_name_idx'),
+            (f'author={author_id}&ordering=newest',
+             'recipe_author_newest_idx'),
+        ):
+            first = self.client.get(f'/api/recipes/?pagination=cursor'
+                                    f'&{query}')
+            for path, url in (
+                ('page', f'/api/recipes/?page=2&{query}'),
+                ('cursor', first.data['next']),
+            ):
+                with self.subTest(query=query, path=path):
+                    plan = self.query_plan(url)
+                    text = ' '.join(plan)
+                    self.assertNotIn('TEMP B-TREE', text)
+                    self.assertNotIn('Sort', text)
+                    if connection.vendor == 'sqlite':
+                        line = next((line for line in plan
+                                     if 'recipes_recipe' in line), '')
+                        self.assertIn(f'USING INDEX {index}', line)
+                        if path == 'cursor':
+                            self.assertRegex(line, r'[<>]\?')
+                    else:
+                        self.assertIn(index, text)
+                        if path == 'cursor':
+                            self.assertIn('Index Cond', text)
+
+
+@mock.patch('foodgram.routers.replica_aliases', return_value=['replica'])
+class ReplicaMiddlewareTests(SimpleTestCase):
+    """Под ASGI middleware асинхронный и держит выбор базы в контексте."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_disabled_without_replicas(self, aliases):
+        aliases.return_value = []
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaMiddleware(lambda request: HttpResponse())
+
+    def test_async_requests(self, aliases):
+        seen = []
+
+        async def get_response(request):
+            seen.append(read_alias.get())
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        factory = RequestFactory(HTTP_AUTHORIZATION='Token key')
+        async_to_sync(middleware)(factory.get('/api/recipes/'))
+        async_to_sync(middleware)(factory.post('/api/recipes/'))
+        async_to_sync(middleware)(factory.get('/api/recipes/'))
+        self.assertEqual(seen, ['replica', None, None])
+        self.assertIsNone(read_alias.get())
+
+
+@override_settings(INSTRUMENTATION_SAMPLE_RATE=1)
+class QueryInstrumentationTests(TestCase):
+    """Запросы из синхронного кода учитываются и в асинхронном режиме."""
+
+    def test_async_request(self):
+        async def get_response(request):
+            await sync_to_async(lambda: list(Tag.objects.all()))()
+            return HttpResponse()
+
+        middleware = QueryInstrumentationMiddleware(get_response)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        response = async_to_sync(middleware)(
+            RequestFactory().get('/api/tags/')
+        )
+        self.assertIn('db;desc="1 queries"', response['Server-Timing'])
@@ -1,11 +1,14 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
 from users.views import UsersViewSet
+from api.async_views import ASYNC_READ_ROUTES, async_read_urls
 from api.views import (
     TagsViewSet,
     IngredientsViewSet,
-    RecipesViewSet
+    RecipesViewSet,
+    database_stats,
 )
 
 router = DefaultRouter()
@@ -14,7 +17,12 @@ router.register(r'tags', TagsViewSet, basename='tags')
 router.register(r'ingredients', IngredientsViewSet, basename='ingredients')
 router.register(r'recipes', RecipesViewSet, basename='recipes')
 
+router_urls = router.urls
+if settings.SERVER_MODE == 'asgi':
+    router_urls = async_read_urls(router_urls, ASYNC_READ_ROUTES)
+
 urlpatterns = [
-    path('', include(router.urls)),
+    path('', include(router_urls)),
+    path('db-stats/', database_stats, name='database-stats'),
     path(r'auth/', include('djoser.urls.authtoken'))
 ]
@@ -1,37 +1,56 @@
-from django.db.models import Sum
+import os
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import (
     SAFE_METHODS,
+    IsAdminUser,
     IsAuthenticated,
     IsAuthenticatedOrReadOnly,
 )
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
-from .methods import create_shopping_cart
+from .cache import (
+    get_feed_ids,
+    get_recipe_representation,
+    get_shopping_list,
+    invalidate_shopping_lists,
+)
+from .mixins import CachedReferenceMixin
+from .methods import FILE_FORMATS, create_shopping_cart, lock_user
+from .pagination import KeysetPagination
 from .filters import IngredientFilter, RecipeFilter
 from .serializers import (
     FavoriteRecipeSerializer,
     ShoppingCartSerializer,
     IngredientSerializer,
     RecipeCreateSerializer,
+    RecipeIdsSerializer,
     RecipeListSerializer,
     TagSerializer,
 )
+from foodgram.postgresql.base import connection_stats
 from recipes.models import (
-    IngredientInRecipe,
+    Favorite,
     Ingredient,
     Recipe,
+    ShoppingCart,
     Tag,
 )
+from users.models import Subscribe
 
 
-class IngredientsViewSet(ReadOnlyModelViewSet):
+class IngredientsViewSet(CachedReferenceMixin, ReadOnlyModelViewSet):
     """
     ReadOnlyModelViewSet для Ингредиентов
     """
+    cache_namespace = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
@@ -39,10 +58,11 @@ class IngredientsViewSet(ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class TagsViewSet(ReadOnlyModelViewSet):
+class TagsViewSet(CachedReferenceMixin, ReadOnlyModelViewSet):
     """
-    ReadOnlyModelViewSet для Ингредиентов
+    ReadOnlyModelViewSet для Тегов
     """
+    cache_namespace = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
@@ -57,11 +77,52 @@ class RecipesViewSet(ModelViewSet):
     permission_classes = (IsAuthenticatedOrReadOnly,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        )
+
     def get_serializer_class(self):
-        if self.action in SAFE_METHODS:
+        if self.request.method in SAFE_METHODS:
             return RecipeListSerializer
         return RecipeCreateSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Общая для всех часть рецепта берется из кэша, флаги текущего
+        пользователя добавляются к ней при каждом запросе теми же
+        аннотациями, что и в списке рецептов.
+        """
+        try:
+            pk = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        user = request.user
+        data = dict(get_recipe_representation(
+            pk, request.build_absolute_uri('/'),
+            lambda: dict(RecipeListSerializer(
+                get_object_or_404(
+                    Recipe.objects.with_related().with_user_flags(user),
+                    pk=pk,
+                ),
+                context={'request': request},
+            ).data)
+        ))
+        data['author'] = dict(data['author'])
+        if user.is_anonymous:
+            data['author']['is_subscribed'] = False
+            data['is_favorited'] = data['is_in_shopping_cart'] = False
+            return Response(data)
+        flags = Recipe.objects.filter(pk=pk).with_user_flags(user).values(
+            'is_favorited', 'is_in_shopping_cart', 'is_author_subscribed'
+        ).first()
+        if flags is None:
+            raise Http404
+        data['author']['is_subscribed'] = flags['is_author_subscribed']
+        data['is_favorited'] = flags['is_favorited']
+        data['is_in_shopping_cart'] = flags['is_in_shopping_cart']
+        return Response(data)
+
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, **kwargs):
@@ -72,18 +133,20 @@ class RecipesViewSet(ModelViewSet):
         user = request.user
         recipe_in_cart = user.shopping_cart.filter(recipe=recipe)
 
-        if request.method == 'POST':
-            serializer = ShoppingCartSerializer(
-                data={'user': user.id, 'recipe': recipe.id}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-
-        if recipe_in_cart.exists():
-            recipe_in_cart.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            lock_user(user)
+            if request.method == 'POST':
+                serializer = ShoppingCartSerializer(
+                    data={'user': user.id, 'recipe': recipe.id}
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                return Response(serializer.data,
+                                status=status.HTTP_201_CREATED)
+
+            if recipe_in_cart.exists():
+                recipe_in_cart.delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Рецепт не в корзине!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
@@ -102,33 +165,157 @@ class RecipesViewSet(ModelViewSet):
         user = request.user
         recipe_in_favorite = user.favorites.filter(recipe=recipe)
 
-        if request.method == 'POST':
-            serializer = FavoriteRecipeSerializer(
-                data={'user': user.id, 'recipe': recipe.id}
-            )
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(serializer.data,
-                            status=status.HTTP_201_CREATED)
-
-        if recipe_in_favorite.exists():
-            recipe_in_favorite.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        with transaction.atomic():
+            lock_user(user)
+            if request.method == 'POST':
+                serializer = FavoriteRecipeSerializer(
+                    data={'user': user.id, 'recipe': recipe.id}
+                )
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+                return Response(serializer.data,
+                                status=status.HTTP_201_CREATED)
+
+            if recipe_in_favorite.exists():
+                recipe_in_favorite.delete()
+                return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'error': 'Рецепт не в избранном!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def insert_links(model, user, recipe_ids):
+        """
+        Вставка связей в точке сохранения. Ограничения внешних ключей
+        проверяются сразу, а не при коммите: рецепт, удаленный после
+        чтения, дает IntegrityError здесь, а не ошибку всего запроса.
+        """
+        using = router.db_for_write(model)
+        with transaction.atomic(using=using):
+            model.objects.bulk_create(
+                [model(user=user, recipe_id=pk) for pk in recipe_ids]
+            )
+            connections[using].check_constraints(
+                table_names=[model._meta.db_table]
+            )
+
+    def batch_update(self, request, model, counter):
+        """
+        Пакетное добавление/удаление рецептов в одной транзакции.
+        Вставка и удаление идут одним запросом без сигналов, поэтому
+        счетчики и кэши в обоих случаях обновляются здесь одним UPDATE.
+        Строка пользователя блокируется: между чтением существующих
+        связей и изменением их не тронет параллельный запрос, и счетчики
+        сдвигаются ровно на число измененных строк.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['recipes']
+        user = request.user
+        recipes = Recipe.objects.filter(id__in=ids)
+        with transaction.atomic():
+            lock_user(user)
+            found = set(recipes.values_list('id', flat=True))
+            links = model.objects.filter(user=user, recipe_id__in=found)
+            linked = set(links.values_list('recipe_id', flat=True))
+            if request.method == 'POST':
+                changed = found - linked
+                try:
+                    self.insert_links(model, user, changed)
+                except IntegrityError:
+                    # Часть рецептов удалили после чтения found.
+                    found = set(recipes.values_list('id', flat=True))
+                    changed = found - linked
+                    self.insert_links(model, user, changed)
+                delta = F(counter) + 1
+                done, skipped = 'created', 'exists'
+            else:
+                changed = linked
+                links._raw_delete(router.db_for_write(model))
+                delta = Greatest(F(counter) - 1, 0)
+                done, skipped = 'deleted', 'missing'
+            Recipe.objects.filter(id__in=changed).update(**{counter: delta})
+            if model is ShoppingCart and changed:
+                transaction.on_commit(
+                    lambda: invalidate_shopping_lists([user.id])
+                )
+        return Response({'results': [
+            {'id': pk, 'status': (done if pk in changed else
+                                  skipped if pk in found else 'not_found')}
+            for pk in ids
+        ]})
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='favorite',
+            url_name='favorite-batch',
+            permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        """
+        Добавление/удаление нескольких рецептов в избранное
+        """
+        return self.batch_update(request, Favorite, 'favorites_count')
+
+    @action(methods=['post', 'delete'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping-cart-batch',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        """
+        Добавление/удаление нескольких рецептов в продуктовую корзину
+        """
+        return self.batch_update(request, ShoppingCart, 'in_carts_count')
+
     @action(methods=['get'],
-            detail=False, )
+            detail=False,
+            permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        """
+        Лента рецептов авторов из подписок, от новых к старым. Первая
+        страница берется по сохраненным id, следующие - по курсору.
+        """
+        paginator = KeysetPagination()
+        authors = Subscribe.objects.filter(
+            user=request.user
+        ).values('author_id')
+        recipes = Recipe.objects.filter(
+            author_id__in=authors
+        ).order_by('-pub_date', '-id')
+        queryset = self.get_queryset().order_by('-pub_date', '-id')
+        if paginator.cursor_query_param in request.query_params:
+            queryset = queryset.filter(author_id__in=authors)
+        else:
+            # На одну запись больше страницы: по ней видно, есть ли next.
+            size = paginator.get_page_size(request) + 1
+            queryset = queryset.filter(id__in=get_feed_ids(
+                request.user.id,
+                lambda: list(recipes.values_list('id', flat=True)[:size]),
+            ))
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = RecipeListSerializer(
+            page, many=True, context={'request': request}
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(methods=['get'],
+            detail=False,
+            permission_classes=[IsAuthenticated])
     def download_shopping_cart(self, request):
         """
-        Скачивание pdf-файла с продуктами из корзины
+        Скачивание txt/pdf-файла с продуктами из корзины
         """
         user = request.user
-        queryset = IngredientInRecipe.objects.filter(
-            recipe__shopping_cart__user=user
+        file_format = request.query_params.get('file_format', 'txt')
+        if file_format not in FILE_FORMATS:
+            return Response({'error': 'Неизвестный формат файла!'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return create_shopping_cart(
+            user, get_shopping_list(user.id), file_format
         )
-        queryset_sort = queryset.values('ingredient__name',
-                                        'ingredient__measurement_unit',
-                                        ).annotate(
-            quantity=Sum('amount')).order_by()
-        return create_shopping_cart(user, queryset_sort)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def database_stats(request):
+    """Счетчики соединений с базой и пула в этом процессе."""
+    return Response({'pid': os.getpid(), 'databases': connection_stats()})
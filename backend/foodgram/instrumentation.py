@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.functional import SimpleLazyObject, empty
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'\bIN \((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+
+current_queries = ContextVar('current_queries', default=None)
+
+
+def fingerprint(sql):
+    """Нормализованный текст запроса: списки IN и числа схлопнуты."""
+    normalized = NUMBER_RE.sub('N', IN_LIST_RE.sub('IN (...)', sql))
+    return hashlib.md5(normalized.encode()).hexdigest()[:12], normalized
+
+
+def record_query(execute, sql, params, many, context):
+    queries = current_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.append((context['connection'].alias, sql,
+                        (time.perf_counter() - started) * 1000))
+
+
+def install_wrapper(sender=None, connection=None, **kwargs):
+    """
+    Обертка ставится на соединение один раз и действует во всех
+    потоках, куда передан контекст запроса (в том числе в пуле ASGI).
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def request_user_id(request):
+    """id пользователя без лишнего обращения к сессии."""
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+        return None
+    return user.pk if getattr(user, 'is_authenticated', False) else None
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Для доли INSTRUMENTATION_SAMPLE_RATE запросов считает запросы
+    к базе и их время, отмечает повторяющиеся запросы (признак N+1),
+    добавляет заголовок Server-Timing и пишет в лог медленные запросы
+    к API и к базе. При нулевой доле middleware отключается целиком.
+    Под ASGI работает асинхронно: список запросов передается через
+    контекст в потоки, где выполняются синхронные представления.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        connection_created.connect(install_wrapper)
+        for connection in connections.all():
+            install_wrapper(connection=connection)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+        queries = []
+        token = current_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.report(request, response, queries,
+                    (time.perf_counter() - started) * 1000)
+        return response
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+        queries = []
+        token = current_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_queries.reset(token)
+        self.report(request, response, queries,
+                    (time.perf_counter() - started) * 1000)
+        return response
+
+    def report(self, request, response, queries, duration):
+        db_time = sum(query[2] for query in queries)
+        fingerprints = {}
+        counts = Counter()
+        for _, sql, _ in queries:
+            key, normalized = fingerprint(sql)
+            fingerprints[key] = normalized
+            counts[key] += 1
+        duplicates = [
+            {'fingerprint': key, 'count': count,
+             'sql': fingerprints[key][:500]}
+            for key, count in counts.most_common()
+            if count >= settings.DUPLICATE_QUERY_THRESHOLD
+        ]
+        timing = [
+            f'db;desc="{len(queries)} queries";dur={db_time:.1f}',
+            f'app;dur={duration:.1f}',
+        ]
+        if duplicates:
+            timing.append(f'dup;desc="{len(duplicates)} repeated"')
+        response['Server-Timing'] = ', '.join(timing)
+
+        match = request.resolver_match
+        context = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'user': request_user_id(request),
+        }
+        if duplicates:
+            logger.info(json.dumps({
+                'event': 'duplicate_queries', **context,
+                'duplicates': duplicates,
+            }, ensure_ascii=False))
+        if duration >= settings.SLOW_REQUEST_MS:
+            logger.warning(json.dumps({
+                'event': 'slow_request', **context,
+                'status': response.status_code,
+                'duration_ms': round(duration, 1),
+                'db_ms': round(db_time, 1),
+                'queries': len(queries),
+                'duplicates': len(duplicates),
+            }, ensure_ascii=False))
+        for alias, sql, query_time in queries:
+            if query_time >= settings.SLOW_QUERY_MS:
+                key, normalized = fingerprint(sql)
+                logger.warning(json.dumps({
+                    'event': 'slow_query', **context,
+                    'database': alias,
+                    'fingerprint': key,
+                    'duration_ms': round(query_time, 1),
+                    'sql': normalized[:1000],
+                }, ensure_ascii=False))
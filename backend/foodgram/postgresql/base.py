@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import deque
+
+from django.db.backends.postgresql import base
+from django.db.backends.postgresql.base import Database
+from psycopg2 import extensions
+
+_pools = {}
+_metrics = {}
+_registry_lock = threading.Lock()
+
+
+class ConnectionMetrics:
+    """Счетчики соединений одного псевдонима базы в процессе."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {
+            'opened': 0,
+            'closed': 0,
+            'health_check_failures': 0,
+            'pool_acquired': 0,
+            'pool_reused': 0,
+            'pool_timeouts': 0,
+            'pool_wait_ms_total': 0.0,
+            'pool_wait_ms_max': 0.0,
+        }
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe_wait(self, seconds):
+        milliseconds = seconds * 1000
+        with self.lock:
+            self.counters['pool_acquired'] += 1
+            self.counters['pool_wait_ms_total'] += milliseconds
+            self.counters['pool_wait_ms_max'] = max(
+                self.counters['pool_wait_ms_max'], milliseconds
+            )
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+
+def connection_usable(connection):
+    try:
+        connection.cursor().execute('SELECT 1')
+    except Database.Error:
+        return False
+    return True
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений psycopg2, общий для потоков процесса.
+    Соединение старше max_age секунд закрывается при возврате.
+    """
+
+    def __init__(self, size, timeout, max_age, metrics):
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.metrics = metrics
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.created = {}
+
+    def acquire(self, connect, check=None):
+        """Соединение из пула или новое. Ждет свободного места timeout."""
+        started = time.monotonic()
+        if not self.slots.acquire(timeout=self.timeout):
+            self.metrics.increment('pool_timeouts')
+            raise Database.OperationalError(
+                f'Нет свободных соединений в пуле ({self.size}) '
+                f'за {self.timeout} с'
+            )
+        self.metrics.observe_wait(time.monotonic() - started)
+        try:
+            while True:
+                with self.lock:
+                    if not self.idle:
+                        break
+                    connection = self.idle.pop()
+                if check is None or check(connection):
+                    self.metrics.increment('pool_reused')
+                    return connection, True
+                self.metrics.increment('health_check_failures')
+                self.discard(connection)
+            connection = connect()
+            with self.lock:
+                self.created[connection] = time.monotonic()
+            return connection, False
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, connection, reusable=True):
+        with self.lock:
+            created = self.created.get(connection, 0)
+        expired = (self.max_age is not None
+                   and time.monotonic() - created >= self.max_age)
+        if reusable and not expired and not connection.closed:
+            with self.lock:
+                self.idle.append(connection)
+        else:
+            self.discard(connection)
+        self.slots.release()
+
+    def discard(self, connection):
+        with self.lock:
+            self.created.pop(connection, None)
+        try:
+            connection.close()
+        except Database.Error:
+            pass
+        self.metrics.increment('closed')
+
+    def stats(self):
+        with self.lock:
+            idle = len(self.idle)
+            total = len(self.created)
+        return {'size': self.size, 'open': total, 'idle': idle,
+                'in_use': total - idle}
+
+
+def get_metrics(alias):
+    with _registry_lock:
+        return _metrics.setdefault(alias, ConnectionMetrics())
+
+
+def get_pool(alias, settings_dict):
+    """Пул псевдонима, если POOL_SIZE задан, иначе None."""
+    size = settings_dict.get('POOL_SIZE') or 0
+    if size <= 0:
+        return None
+    metrics = get_metrics(alias)
+    with _registry_lock:
+        if alias not in _pools:
+            _pools[alias] = ConnectionPool(
+                size, settings_dict.get('POOL_TIMEOUT', 10),
+                settings_dict['CONN_MAX_AGE'], metrics,
+            )
+        return _pools[alias]
+
+
+def connection_stats():
+    """Счетчики и состояние пулов всех псевдонимов процесса."""
+    with _registry_lock:
+        aliases = dict(_metrics)
+        pools = dict(_pools)
+    return {
+        alias: {**metrics.snapshot(),
+                **(pools[alias].stats() if alias in pools else {})}
+        for alias, metrics in aliases.items()
+    }
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    Postgres с проверкой постоянных соединений и необязательным пулом.
+
+    CONN_HEALTH_CHECKS: перед первым запросом к базе в каждом запросе
+    к API переиспользуемое соединение проверяется SELECT 1 и при
+    ошибке открывается заново (как в Django 4.1).
+    POOL_SIZE, POOL_TIMEOUT: соединения берутся из общего пула процесса
+    и возвращаются в него в конце каждого запроса к API; CONN_MAX_AGE
+    ограничивает время жизни соединения в пуле.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_enabled = self.settings_dict.get(
+            'CONN_HEALTH_CHECKS', False
+        )
+        self.health_check_done = False
+        self.metrics = get_metrics(self.alias)
+        self.pool = get_pool(self.alias, self.settings_dict)
+
+    def open_connection(self, conn_params):
+        connection = super().get_new_connection(conn_params)
+        self.metrics.increment('opened')
+        return connection
+
+    def get_new_connection(self, conn_params):
+        if self.pool is None:
+            self.health_check_done = True
+            return self.open_connection(conn_params)
+        connection, _ = self.pool.acquire(
+            lambda: self.open_connection(conn_params),
+            connection_usable if self.health_check_enabled else None,
+        )
+        self.health_check_done = True
+        return connection
+
+    def ensure_connection(self):
+        if (self.connection is not None and self.health_check_enabled
+                and not self.health_check_done
+                and not self.in_atomic_block):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.metrics.increment('health_check_failures')
+                self.close()
+        super().ensure_connection()
+
+    def _close(self):
+        if self.pool is None:
+            super()._close()
+            self.metrics.increment('closed')
+            return
+        connection = self.connection
+        reusable = not self.in_atomic_block
+        if reusable and not connection.closed:
+            try:
+                if (connection.get_transaction_status()
+                        != extensions.TRANSACTION_STATUS_IDLE):
+                    connection.rollback()
+            except Database.Error:
+                reusable = False
+        self.pool.release(connection, reusable)
+
+    def close_if_unusable_or_obsolete(self):
+        """Вызывается в начале и в конце каждого запроса к API."""
+        self.health_check_done = False
+        if (self.pool is not None and self.connection is not None
+                and not self.in_atomic_block):
+            self.close()
+            return
+        super().close_if_unusable_or_obsolete()
@@ -0,0 +1,118 @@
+import hashlib
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_KEY = 'primary_pin:{}'
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != 'default']
+
+
+@contextmanager
+def primary():
+    """Чтения внутри блока идут в основную базу."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+def client_pin_key(request):
+    """
+    Клиент определяется по заголовку Authorization или сессии, без
+    обращения к базе: пользователь еще не аутентифицирован.
+    """
+    credentials = (request.META.get('HTTP_AUTHORIZATION')
+                   or request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not credentials:
+        return None
+    return PIN_KEY.format(hashlib.sha256(credentials.encode()).hexdigest())
+
+
+class ReplicaMiddleware:
+    """
+    Безопасные запросы читают со случайной реплики. После успешного
+    изменяющего запроса клиент на REPLICA_PIN_SECONDS закрепляется
+    за основной базой, чтобы видеть свои изменения, пока реплика
+    догоняет. Без реплик middleware отключается, под ASGI работает
+    асинхронно и не занимает поток на время запроса.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.replicas = replica_aliases()
+        if not self.replicas:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def choose_alias(self, request, pinned):
+        if request.method in SAFE_METHODS and not pinned:
+            return random.choice(self.replicas)
+        return None
+
+    def should_pin(self, request, pin_key, response):
+        return (request.method not in SAFE_METHODS and pin_key
+                and response.status_code < 400)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        pin_key = client_pin_key(request)
+        pinned = (request.method in SAFE_METHODS and pin_key
+                  and cache.get(pin_key))
+        token = read_alias.set(self.choose_alias(request, pinned))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if self.should_pin(request, pin_key, response):
+            cache.set(pin_key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        pin_key = client_pin_key(request)
+        pinned = (request.method in SAFE_METHODS and pin_key
+                  and await sync_to_async(cache.get,
+                                          thread_sensitive=False)(pin_key))
+        token = read_alias.set(self.choose_alias(request, pinned))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if self.should_pin(request, pin_key, response):
+            await sync_to_async(cache.set, thread_sensitive=False)(
+                pin_key, True, settings.REPLICA_PIN_SECONDS
+            )
+        return response
+
+
+class ReplicaRouter:
+    """Запись и миграции - в основную базу, чтение - по ReplicaMiddleware."""
+
+    def db_for_read(self, model, **hints):
+        return read_alias.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == 'default'
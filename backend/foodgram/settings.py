@@ -33,6 +33,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'foodgram.instrumentation.QueryInstrumentationMiddleware',
+    'foodgram.routers.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -63,15 +65,65 @@ WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.postgresql',
         'NAME': os.getenv('POSTGRES_DB', default='postgres'),
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default=5432)
+        'PORT': os.getenv('DB_PORT', default=5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'DB_HEALTH_CHECKS', default='False'
+        ) == 'True',
+        'POOL_SIZE': int(os.getenv('DB_POOL_SIZE', default=0)),
+        'POOL_TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', default=10)),
     }
 }
 
+if os.getenv('DB_ENGINE', default='postgresql') == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH',
+                              default=os.path.join(BASE_DIR, 'db.sqlite3')),
+        }
+    }
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    REPLICAS = [{'NAME': path} for path in os.getenv(
+        'SQLITE_REPLICA_PATHS', default=''
+    ).split(',') if path]
+else:
+    REPLICAS = [{'HOST': host} for host in os.getenv(
+        'DB_REPLICA_HOSTS', default=''
+    ).split(',') if host]
+for number, replica in enumerate(REPLICAS, 1):
+    DATABASES['replica' if number == 1 else f'replica_{number}'] = {
+        **DATABASES['default'], **replica, 'TEST': {'MIRROR': 'default'},
+    }
+
+if os.getenv('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+            'LOCATION': os.getenv('MEMCACHED_LOCATION').split(','),
+        }
+    }
+else:
+    # Кэш в памяти процесса: у каждого воркера и каждой команды свой,
+    # сбросы версий и инвалидации между ними не видны. Только для
+    # разработки и тестов.
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+DATABASE_ROUTERS = ['foodgram.routers.ReplicaRouter']
+
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', default=5))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,11 +155,48 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', default=2))
+
+SHOPPING_CART_FONT = os.getenv(
+    'SHOPPING_CART_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
+SERVER_MODE = os.getenv('SERVER_MODE', default='wsgi')
+
+ASYNC_READ_WORKERS = int(os.getenv('ASYNC_READ_WORKERS', default=4))
+
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.getenv('INSTRUMENTATION_SAMPLE_RATE', default=0)
+)
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', default=500))
+
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', default=100))
+
+DUPLICATE_QUERY_THRESHOLD = int(
+    os.getenv('DUPLICATE_QUERY_THRESHOLD', default=3)
+)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'foodgram.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -115,7 +204,7 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PageNumberOrKeysetPagination',
     'PAGE_SIZE': 6,
 }
 
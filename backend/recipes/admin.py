@@ -1,5 +1,8 @@
 from django.contrib import admin
 
+from api.cache import invalidate_shopping_lists, recipe_shopping_list_users
+from api.search import update_search_vectors
+
 from .models import (
     Tag,
     Ingredient,
@@ -16,7 +19,7 @@ class RecipeIngredientInline(admin.TabularInline):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('author', 'name')
+    list_display = ('author', 'name', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
     exclude = ('ingredients',)
 
@@ -24,6 +27,14 @@ class RecipeAdmin(admin.ModelAdmin):
         RecipeIngredientInline,
     ]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_vectors([form.instance.id])
+        if change:
+            invalidate_shopping_lists(
+                recipe_shopping_list_users([form.instance.id])
+            )
+
 
 admin.site.register(Tag)
 admin.site.register(Ingredient)
@@ -0,0 +1,108 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumb': ((320, 320), True),
+    'card': ((960, 720), False),
+}
+VARIANTS_DIR = 'recipes/variants'
+VARIANT_FORMAT, VARIANT_EXTENSION = (
+    ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+)
+VARIANT_QUALITY = 80
+
+executor = (ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS)
+            if settings.IMAGE_VARIANT_WORKERS else None)
+
+
+def variant_name(name, variant):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    return f'{VARIANTS_DIR}/{stem}_{variant}.{VARIANT_EXTENSION}'
+
+
+def variant_url(image, variant):
+    """
+    URL уменьшенной копии, пока ее нет - URL оригинала. Наличие копий
+    берется из флага рецепта image_variants, хранилище не опрашивается.
+    """
+    if getattr(image.instance, 'image_variants', False):
+        return default_storage.url(variant_name(image.name, variant))
+    return image.url
+
+
+def generate_variants(name):
+    """Создает уменьшенные копии изображения рецепта, True при успехе."""
+    try:
+        with default_storage.open(name) as file:
+            image = ImageOps.exif_transpose(Image.open(file))
+            image.load()
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image = image.convert('RGB')
+        for variant, (size, crop) in VARIANTS.items():
+            if crop:
+                resized = ImageOps.fit(image, size, Image.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail(size, Image.LANCZOS)
+            buffer = BytesIO()
+            resized.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+            path = variant_name(name, variant)
+            if default_storage.exists(path):
+                default_storage.delete(path)
+            default_storage.save(path, ContentFile(buffer.getvalue()))
+    except Exception:
+        logger.exception('Не удалось создать копии изображения %s', name)
+        return False
+    return True
+
+
+def variants_exist(name):
+    return all(default_storage.exists(variant_name(name, variant))
+               for variant in VARIANTS)
+
+
+def build_variants(name, on_done):
+    """Создает копии и после успеха вызывает on_done."""
+    if generate_variants(name):
+        on_done()
+
+
+def build_variants_in_thread(name, on_done):
+    """
+    build_variants в потоке пула: соединения с базой, открытые
+    on_done, не переживают задачу.
+    """
+    close_old_connections()
+    try:
+        build_variants(name, on_done)
+    except Exception:
+        logger.exception('Не удалось отметить копии изображения %s', name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(name, on_done):
+    """
+    После коммита создает копии в фоновом потоке, чтобы не занимать
+    поток запроса. Без IMAGE_VARIANT_WORKERS - синхронно.
+    """
+    if executor is None:
+        transaction.on_commit(lambda: build_variants(name, on_done))
+    else:
+        transaction.on_commit(
+            lambda: executor.submit(build_variants_in_thread, name, on_done)
+        )
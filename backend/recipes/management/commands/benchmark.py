@@ -0,0 +1,192 @@
+import json
+import random
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe
+from users.models import CustomUser
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = max(0, min(len(values) - 1,
+                       round(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = ' Замер задержек и числа запросов на основных эндпоинтах API '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Запросов на каждый сценарий')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--output', default='benchmark.json',
+                            help='Файл для результатов в JSON')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--url',
+                            help='Адрес запущенного сервера, например '
+                                 'http://127.0.0.1:8000. Без него запросы '
+                                 'идут через тестовый клиент')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='Параллельных запросов в режиме --url')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        user = CustomUser.objects.annotate(
+            total=Count('follower', distinct=True)
+            + Count('shopping_cart', distinct=True)
+        ).order_by('-total').first()
+        if user is None or not Recipe.objects.exists():
+            raise CommandError('Нет данных: запустите generate_data')
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.headers = {'Authorization': f'Token {token.key}'}
+        self.base_url = options['url'] and options['url'].rstrip('/')
+        self.sessions = threading.local()
+        self.recipe_ids = list(Recipe.objects.values_list('id', flat=True))
+        self.ingredient_names = list(
+            Ingredient.objects.values_list('name', flat=True)[:1000]
+        )
+
+        results = {}
+        for name, url in self.scenarios():
+            self.stdout.write(f'{name}...')
+            if self.base_url:
+                results[name] = self.measure_http(
+                    url, options['requests'], options['warmup'],
+                    options['concurrency'],
+                )
+                summary = f'rps={results[name]["throughput_rps"]:.1f}'
+            else:
+                results[name] = self.measure(url, options['requests'],
+                                             options['warmup'])
+                summary = f'queries={results[name]["queries"]["max"]}'
+            self.stdout.write(
+                f'  p50={results[name]["latency_ms"]["p50"]:.2f}ms '
+                f'p95={results[name]["latency_ms"]["p95"]:.2f}ms '
+                f'p99={results[name]["latency_ms"]["p99"]:.2f}ms {summary}'
+            )
+
+        report = {
+            'revision': git_revision(),
+            'created': datetime.now().isoformat(),
+            'database': connection.vendor,
+            'url': self.base_url,
+            'concurrency': options['concurrency'] if self.base_url else 1,
+            'recipes': len(self.recipe_ids),
+            'requests': options['requests'],
+            'results': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as output:
+            json.dump(report, output, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(
+            f'Результаты записаны в {options["output"]}'
+        ))
+
+    def scenarios(self):
+        pages = max(1, len(self.recipe_ids) // settings.REST_FRAMEWORK[
+            'PAGE_SIZE'
+        ])
+        return (
+            ('current_user', lambda: '/api/users/me/'),
+            ('recipes_list', lambda: '/api/recipes/'),
+            ('recipes_deep_page',
+             lambda: f'/api/recipes/?page={self.rng.randint(1, pages)}'),
+            ('recipe_detail',
+             lambda: f'/api/recipes/{self.rng.choice(self.recipe_ids)}/'),
+            ('subscriptions',
+             lambda: '/api/users/subscriptions/?recipes_limit=3'),
+            ('feed', lambda: '/api/recipes/feed/'),
+            ('download_shopping_cart',
+             lambda: '/api/recipes/download_shopping_cart/'),
+            ('ingredient_search', lambda: '/api/ingredients/?search={}'.format(
+                self.rng.choice(self.ingredient_names)[:3]
+            )),
+        )
+
+    def request(self, url):
+        response = self.client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+
+    def http_request(self, url):
+        session = getattr(self.sessions, 'session', None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        response = session.get(self.base_url + url, headers=self.headers)
+        if response.status_code != 200:
+            raise CommandError(f'{url}: {response.status_code}')
+
+    def timed_http_request(self, url):
+        started = time.perf_counter()
+        self.http_request(url)
+        return (time.perf_counter() - started) * 1000
+
+    def measure_http(self, url, count, warmup, concurrency):
+        """Задержки и пропускная способность сервера под нагрузкой."""
+        for _ in range(warmup):
+            self.http_request(url())
+        urls = [url() for _ in range(count)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(self.timed_http_request, urls))
+        elapsed = time.perf_counter() - started
+        return {
+            'latency_ms': self.latency_stats(latencies),
+            'throughput_rps': count / elapsed,
+        }
+
+    def latency_stats(self, latencies):
+        latency = {f'p{percent}': percentile(latencies, percent)
+                   for percent in PERCENTILES}
+        latency['mean'] = statistics.mean(latencies)
+        latency['max'] = max(latencies)
+        return latency
+
+    def measure(self, url, count, warmup):
+        for _ in range(warmup):
+            self.request(url())
+        latencies, queries = [], []
+        for _ in range(count):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                self.request(url())
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+        return {
+            'latency_ms': self.latency_stats(latencies),
+            'queries': {
+                'min': min(queries),
+                'max': max(queries),
+                'mean': statistics.mean(queries),
+            },
+        }
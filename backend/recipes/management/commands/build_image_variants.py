@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from api.signals import mark_variants_ready
+from recipes.images import generate_variants, variants_exist
+from recipes.models import Recipe
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = ' Создание уменьшенных копий изображений существующих рецептов '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = Recipe.objects.filter(image_variants=False).exclude(
+            image=''
+        ).order_by('image').values_list('image', flat=True).distinct()
+        last, done, failed = '', 0, 0
+        while True:
+            names = list(pending.filter(image__gt=last)[:batch_size])
+            if not names:
+                break
+            last = names[-1]
+            ready = [name for name in names
+                     if variants_exist(name) or generate_variants(name)]
+            mark_variants_ready(ready)
+            done += len(ready)
+            failed += len(names) - len(ready)
+            self.stdout.write(f'Готово изображений: {done}, ошибок: {failed}')
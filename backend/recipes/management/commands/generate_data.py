@@ -0,0 +1,222 @@
+import io
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from faker import Faker
+from PIL import Image
+
+from api.search import update_search_vectors
+from recipes.images import generate_variants, variants_exist
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientInRecipe,
+    Recipe,
+    ShoppingCart,
+    Tag,
+)
+from users.models import CustomUser, Subscribe
+
+BATCH_SIZE = 2000
+PUB_DATE_SPREAD = timedelta(days=365)
+PASSWORD = 'foodgram-load-test'
+IMAGE_NAME = 'recipes/load_test.png'
+
+
+def zipf_choices(population, count, rng, alpha=1.2):
+    """Выборка без повторов с перекосом в начало популяции:
+    немногие популярные авторы и рецепты собирают большую часть связей."""
+    count = min(count, len(population) // 2)
+    chosen = set()
+    while len(chosen) < count:
+        index = int(rng.paretovariate(alpha)) - 1
+        chosen.add(population[index % len(population)])
+    return chosen
+
+
+class Command(BaseCommand):
+    help = ' Генерация пользователей, рецептов и связей для нагрузки '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--recipes', type=int, default=2000)
+        parser.add_argument('--ingredients', type=int, default=8,
+                            help='Среднее число ингредиентов в рецепте')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Среднее число избранных у пользователя')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Среднее число подписок у пользователя')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Среднее число рецептов в корзине')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.fake = Faker('ru_RU')
+        if options['seed'] is not None:
+            self.fake.seed_instance(options['seed'])
+        self.batch_size = options['batch_size']
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        if not ingredient_ids or not tag_ids:
+            raise CommandError('Сначала загрузите справочники: load_data')
+
+        started = time.monotonic()
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'])
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, tag_ids, ingredient_ids,
+                options['ingredients'],
+            )
+            self.create_links(Favorite, user_ids, recipe_ids,
+                              options['favorites'])
+            self.create_links(ShoppingCart, user_ids, recipe_ids,
+                              options['cart'])
+            self.create_subscriptions(user_ids, options['subscriptions'])
+            self.analyze(CustomUser, Recipe, Recipe.tags.through,
+                         IngredientInRecipe, Favorite, ShoppingCart,
+                         Subscribe)
+            update_search_vectors(recipe_ids)
+            call_command('reconcile_counters', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, рецептов: '
+            f'{len(recipe_ids)} за {time.monotonic() - started:.1f} с'
+        ))
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size,
+                                  ignore_conflicts=True)
+
+    def analyze(self, *models):
+        """
+        Статистика для планировщика Postgres: без нее запросы по только
+        что заполненным таблицам выбирают полный перебор для каждой строки.
+        """
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            for model in models:
+                cursor.execute('ANALYZE {}'.format(
+                    connection.ops.quote_name(model._meta.db_table)
+                ))
+
+    def created_ids(self, model, last_id):
+        """id новых строк: bulk_create заполняет их не во всех базах."""
+        return list(model.objects.filter(id__gt=last_id).order_by(
+            'id'
+        ).values_list('id', flat=True))
+
+    def last_id(self, model):
+        return model.objects.order_by('-id').values_list(
+            'id', flat=True
+        ).first() or 0
+
+    def create_users(self, count):
+        self.stdout.write(self.style.WARNING('Создаются пользователи'))
+        last_id = self.last_id(CustomUser)
+        password = make_password(PASSWORD)
+        suffix = self.rng.randrange(10 ** 8)
+        self.bulk_create(CustomUser, [
+            CustomUser(
+                username=f'load_{suffix}_{number}',
+                email=f'load_{suffix}_{number}@example.com',
+                first_name=self.fake.first_name(),
+                last_name=self.fake.last_name(),
+                password=password,
+            )
+            for number in range(count)
+        ])
+        return self.created_ids(CustomUser, last_id)
+
+    def create_image(self):
+        if not default_storage.exists(IMAGE_NAME):
+            buffer = io.BytesIO()
+            Image.new('RGB', (600, 400), (230, 180, 90)).save(buffer, 'PNG')
+            default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+            generate_variants(IMAGE_NAME)
+        return IMAGE_NAME, variants_exist(IMAGE_NAME)
+
+    def create_recipes(self, count, user_ids, tag_ids, ingredient_ids,
+                       ingredients_avg):
+        self.stdout.write(self.style.WARNING('Создаются рецепты'))
+        image, image_variants = self.create_image()
+        last_id = self.last_id(Recipe)
+        now = timezone.now()
+        authors = [self.rng.choice(user_ids[:max(1, len(user_ids) // 5)])
+                   if self.rng.random() < 0.8 else self.rng.choice(user_ids)
+                   for _ in range(count)]
+        self.bulk_create(Recipe, [
+            Recipe(
+                author_id=author_id,
+                name=self.fake.sentence(nb_words=3)[:200],
+                text=self.fake.paragraph(nb_sentences=5),
+                cooking_time=self.rng.randint(5, 180),
+                image=image,
+                image_variants=image_variants,
+                pub_date=now - PUB_DATE_SPREAD * self.rng.random(),
+            )
+            for author_id in authors
+        ])
+        recipe_ids = self.created_ids(Recipe, last_id)
+
+        self.stdout.write(self.style.WARNING('Добавляются теги и ингредиенты'))
+        self.bulk_create(Recipe.tags.through, [
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in self.rng.sample(
+                tag_ids, self.rng.randint(1, len(tag_ids))
+            )
+        ])
+        links = []
+        for recipe_id in recipe_ids:
+            size = max(1, min(len(ingredient_ids), int(
+                self.rng.gauss(ingredients_avg, ingredients_avg / 3)
+            )))
+            links.extend(
+                IngredientInRecipe(recipe_id=recipe_id,
+                                   ingredient_id=ingredient_id,
+                                   amount=self.rng.randint(1, 500))
+                for ingredient_id in self.rng.sample(ingredient_ids, size)
+            )
+            if len(links) >= self.batch_size:
+                self.bulk_create(IngredientInRecipe, links)
+                links = []
+        self.bulk_create(IngredientInRecipe, links)
+        return recipe_ids
+
+    def create_links(self, model, user_ids, recipe_ids, average):
+        self.stdout.write(self.style.WARNING(
+            f'Создаются связи {model._meta.verbose_name_plural}'
+        ))
+        links = []
+        for user_id in user_ids:
+            count = int(self.rng.expovariate(1 / average)) if average else 0
+            links.extend(
+                model(user_id=user_id, recipe_id=recipe_id)
+                for recipe_id in zipf_choices(recipe_ids, count, self.rng)
+            )
+            if len(links) >= self.batch_size:
+                self.bulk_create(model, links)
+                links = []
+        self.bulk_create(model, links)
+
+    def create_subscriptions(self, user_ids, average):
+        self.stdout.write(self.style.WARNING('Создаются подписки'))
+        links = []
+        for user_id in user_ids:
+            count = int(self.rng.expovariate(1 / average)) if average else 0
+            links.extend(
+                Subscribe(user_id=user_id, author_id=author_id)
+                for author_id in zipf_choices(user_ids, count, self.rng)
+                if author_id != user_id
+            )
+        self.bulk_create(Subscribe, links)
@@ -1,34 +1,99 @@
 import csv
+import json
+import os
+import time
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.cache import bump_data_version
 from recipes.models import Ingredient, Tag
 
+BATCH_SIZE = 5000
+TAGS = (
+    ('Завтрак', 'breakfast', '#FFFC66'),
+    ('Обед', 'lunch', '#54E709'),
+    ('Ужин', 'dinner', '#E4007C'),
+)
+
+
+def read_csv(path):
+    with open(path, encoding='utf-8') as fixture:
+        for name, unit in csv.reader(fixture):
+            yield name, unit
+
+
+def read_json(path):
+    with open(path, encoding='utf-8') as fixture:
+        for row in json.load(fixture):
+            yield row['name'], row['measurement_unit']
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
 
 class Command(BaseCommand):
     help = ' Загрузка тегов и ингредиентов '
 
-    def handle(self, *args, **options):
-        self.stdout.write(self.style.WARNING('Загружаются тэги'))
-        Tag.objects.get_or_create(
-            name='Завтрак',
-            slug='breakfast',
-            color='#FFFC66'
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Файл с ингредиентами',
         )
-        Tag.objects.get_or_create(
-            name='Обед',
-            slug='lunch',
-            color='#54E709'
+        parser.add_argument(
+            '--format',
+            choices=READERS.keys(),
+            help='Формат файла, по умолчанию по расширению',
         )
-        Tag.objects.get_or_create(
-            name='Ужин',
-            slug='dinner',
-            color='#E4007C'
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (options['format']
+                       or os.path.splitext(path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if not os.path.exists(path):
+            raise CommandError(f'Файл не найден: {path}')
+
+        self.stdout.write(self.style.WARNING('Загружаются тэги'))
+        Tag.objects.bulk_create(
+            [Tag(name=name, slug=slug, color=color)
+             for name, slug, color in TAGS],
+            ignore_conflicts=True,
         )
+        bump_data_version('tags')
+
         self.stdout.write(self.style.WARNING('Загружаются ингредиенты'))
-        with open('data/ingredients.csv',
-                  encoding='utf-8') as fixture:
-            reader = csv.reader(fixture)
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(name=name,
-                                                 measurement_unit=unit)
+        started = time.monotonic()
+        created = read = 0
+        with transaction.atomic():
+            seen = set(Ingredient.objects.values_list(
+                'name', 'measurement_unit'
+            ).iterator())
+            batch = []
+            for row in READERS[file_format](path):
+                read += 1
+                if row in seen:
+                    continue
+                seen.add(row)
+                batch.append(Ingredient(name=row[0], measurement_unit=row[1]))
+                if len(batch) >= options['batch_size']:
+                    Ingredient.objects.bulk_create(batch,
+                                                   ignore_conflicts=True)
+                    created += len(batch)
+                    batch = []
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+            created += len(batch)
+        bump_data_version('ingredients')
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено ингредиентов: {created} '
+            f'за {elapsed:.2f} с ({read / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import CustomUser, Subscribe
+
+BATCH_SIZE = 1000
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Subscribe, 'author'),
+)
+
+
+def actual_count(related, field):
+    return Coalesce(Subquery(
+        related.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = ' Пересчет счетчиков избранного, корзин, рецептов и подписчиков '
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, counter, related, field in COUNTERS:
+            drifted = list(model.objects.order_by().annotate(
+                actual=actual_count(related, field)
+            ).exclude(**{counter: F('actual')}).values_list('pk', flat=True))
+            for start in range(0, len(drifted), batch_size):
+                model.objects.filter(
+                    pk__in=drifted[start:start + batch_size]
+                ).update(**{counter: actual_count(related, field)})
+            self.stdout.write(
+                f'{model.__name__}.{counter}: исправлено {len(drifted)}'
+            )
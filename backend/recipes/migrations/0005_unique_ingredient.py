@@ -0,0 +1,50 @@
+# Generated by Django 3.2.18 on 2026-10-18 03:12
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сводит дубли ингредиентов к одной записи перед уникальным ключом."""
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        extra_ids = list(Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=keep_id).values_list('id', flat=True))
+        recipes_with_kept = IngredientInRecipe.objects.filter(
+            ingredient_id=keep_id
+        ).values('recipe_id')
+        IngredientInRecipe.objects.filter(
+            ingredient_id__in=extra_ids, recipe_id__in=recipes_with_kept
+        ).delete()
+        for extra_id in extra_ids:
+            IngredientInRecipe.objects.filter(
+                ingredient_id=extra_id
+            ).exclude(
+                recipe_id__in=IngredientInRecipe.objects.filter(
+                    ingredient_id=keep_id
+                ).values('recipe_id')
+            ).update(ingredient_id=keep_id)
+        Ingredient.objects.filter(id__in=extra_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_ingredient_search_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
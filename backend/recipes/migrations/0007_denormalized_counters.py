@@ -0,0 +1,53 @@
+# Generated by Django 3.2.18 on 2026-10-18 03:22
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'Recipe', 'favorites_count', 'recipes', 'Favorite',
+     'recipe'),
+    ('recipes', 'Recipe', 'in_carts_count', 'recipes', 'ShoppingCart',
+     'recipe'),
+    ('users', 'CustomUser', 'recipes_count', 'recipes', 'Recipe', 'author'),
+    ('users', 'CustomUser', 'followers_count', 'users', 'Subscribe',
+     'author'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    """Счетчики для уже существующих записей."""
+    for app, model, counter, related_app, related, field in COUNTERS:
+        related_model = apps.get_model(related_app, related)
+        apps.get_model(app, model).objects.update(**{counter: Coalesce(
+            Subquery(
+                related_model.objects.filter(
+                    **{field: OuterRef('pk')}
+                ).order_by().values(field).annotate(
+                    total=Count('pk')
+                ).values('total')
+            ),
+            0,
+        )})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_search_vector'),
+        ('users', '0003_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_recipe_feed_orderings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Есть уменьшенные копии'),
+        ),
+    ]
@@ -1,8 +1,11 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (MinValueValidator,
                                     MaxValueValidator)
 from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch
+from django.utils import timezone
 
-from users.models import CustomUser
+from users.models import CustomUser, Subscribe
 
 MIN_AMOUNT = 1
 MAX_AMOUNT = 32000
@@ -50,11 +53,51 @@ class Ingredient(models.Model):
         ordering = ('name',)
         verbose_name = 'Ингредиент',
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient',
+            )
+        ]
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с подгрузкой связанных данных одним набором
+    запросов вместо запросов на каждый рецепт."""
+
+    def with_related(self):
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            'tags',
+            Prefetch(
+                'IngredientInRecipe',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                ),
+            ),
+        )
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного, корзины и подписки на автора."""
+        if user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_author_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author')
+            )),
+        )
+
+
 class Recipe(models.Model):
     """Модель для работы с Рецептами."""
     author = models.ForeignKey(
@@ -82,6 +125,11 @@ class Recipe(models.Model):
         verbose_name='Изображение',
         upload_to='recipes/'
     )
+    image_variants = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Есть уменьшенные копии'
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -94,11 +142,44 @@ class Recipe(models.Model):
         ],
         verbose_name='Время приготовления'
     )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах'
+    )
+    pub_date = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name='Дата публикации'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('name',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_newest_idx'),
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['cooking_time', '-id'],
+                         name='recipe_quickest_idx'),
+            models.Index(fields=['name', '-id'], name='recipe_name_idx'),
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_newest_idx'),
+        ]
 
     def __str__(self):
         return self.name
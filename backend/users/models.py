@@ -28,6 +28,16 @@ class CustomUser(AbstractUser):
         max_length=150,
         verbose_name='Пароль',
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
 
     class Meta:
         ordering = ('-id',)
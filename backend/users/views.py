@@ -1,3 +1,5 @@
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value)
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
 from rest_framework import status
@@ -7,7 +9,28 @@ from rest_framework.permissions import (IsAuthenticatedOrReadOnly,
 from rest_framework.response import Response
 
 from .models import CustomUser, Subscribe
+from api.methods import get_recipes_limit
 from api.serializers import UsersSerializer, SubscribeSerializer
+from recipes.models import Recipe
+
+
+def subscriptions_queryset(user, recipes_limit=None):
+    """
+    Подписки с первыми recipes_limit рецептами каждого автора: превью
+    всех авторов страницы грузятся одним запросом.
+    """
+    recipes = Recipe.objects.all()
+    if recipes_limit is not None:
+        recipes = recipes.filter(id__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('id')[:recipes_limit]
+        ))
+    return CustomUser.objects.filter(following__user=user).annotate(
+        is_subscribed=Value(True, output_field=BooleanField()),
+    ).order_by('-id').prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='recipes_preview')
+    )
 
 
 class UsersViewSet(UserViewSet):
@@ -17,6 +40,16 @@ class UsersViewSet(UserViewSet):
     serializer_class = UsersSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
+    def get_queryset(self):
+        """Флаг подписки аннотируется, а не проверяется для каждого."""
+        queryset = super().get_queryset()
+        user = self.request.user
+        if user.is_anonymous:
+            return queryset
+        return queryset.annotate(is_subscribed=Exists(
+            Subscribe.objects.filter(user=user, author=OuterRef('pk'))
+        ))
+
     @action(methods=['post', 'delete'], detail=True,
             permission_classes=[IsAuthenticated])
     def subscribe(self, request, id):
@@ -40,7 +73,8 @@ class UsersViewSet(UserViewSet):
             permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
         """Функция вывода подписок."""
-        queryset = CustomUser.objects.filter(following__user=request.user)
+        queryset = subscriptions_queryset(request.user,
+                                          get_recipes_limit(request))
         page = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(
             page, many=True, context={'request': request}